@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Server locale e benchmark dei client, eseguibili senza rete:
+
+    python -m benchmarks.run
+"""
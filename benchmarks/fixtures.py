@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Registrazione delle risposte reali di Instagram, da far servire poi
+al server locale (StandInServer(fixtures=...)) al posto dei dati
+generati.
+
+Esempio:
+
+ >>> transport = RecordingTransport("fixtures")
+ >>> InstagramJsonClient(transport=transport).get_by_hashtag("mfw", count=100, top_posts=False)
+ >>> with StandInServer(fixtures="fixtures") as server:
+ >>>     InstagramJsonClient(base_url=server.base_url).get_by_hashtag("mfw", count=100, top_posts=False)
+"""
+import hashlib
+import os
+import re
+from urllib.parse import urlparse
+
+from pyinstagram import Transport
+
+
+def fixture_name(path):
+    """
+    :param path: str - percorso e querystring della richiesta (es. /p/BZPK7bAFDDF?__a=1)
+    :return: str - nome del file della risposta registrata
+    """
+    # l'access token non deve finire nel nome dei file né impedire il replay
+    path = re.sub(r'access_token=[^&]*', 'access_token=x', path)
+    return hashlib.sha1(path.encode('utf-8')).hexdigest() + '.fixture'
+
+
+class RecordingTransport(Transport):
+    """
+    Transport che salva ogni risposta ricevuta nella cartella delle
+    fixtures (codice di stato sulla prima riga, poi il corpo).
+    """
+    def __init__(self, directory, **kwargs):
+        """
+        :param directory: str - cartella in cui salvare le risposte
+        :param kwargs: parametri di Transport
+        """
+        super(RecordingTransport, self).__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def request(self, method, url, **kwargs):
+        res = super(RecordingTransport, self).request(method, url, **kwargs)
+        parsed = urlparse(url)
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+        with open(os.path.join(self.directory, fixture_name(path)), 'wb') as f:
+            f.write("{}\n".format(res.status_code).encode('ascii'))
+            f.write(res.content)
+        return res
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark dei metodi dei client sul server locale (StandInServer).
+
+Per ogni caso vengono misurati pagine al secondo, media al secondo
+e memoria massima (RSS) ogni 10k media, oltre al tempo di import
+della libreria. Ogni caso gira in un processo separato, così che
+la memoria di un caso non influenzi quella dei successivi.
+
+Uso:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --pages 50 --page-size 100 --cases json_hashtag_orm,api_hashtag
+    python -m benchmarks.run --fixtures fixtures/ --output results.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# il server genera (pages * page_size) media per utente e per hashtag
+CASES = (
+    'json_hashtag_json',
+    'json_hashtag_dict',
+    'json_hashtag_records',
+    'json_hashtag_orm',
+    'json_hashtag_columns',
+    'json_hashtag_parallel',
+    'json_user_records',
+    'json_media_codes',
+    'json_comments',
+    'aio_media_codes',
+    'scheduler_hashtag',
+    'api_hashtag',
+    'api_user',
+)
+
+# numero di post per i casi che lavorano sui singoli post
+CODES = 200
+
+
+def _max_rss():
+    """
+    :return: int - memoria massima usata dal processo, in byte
+    """
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux restituisce KB, macOS byte
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _codes(count):
+    from benchmarks.server import media_id
+    return ['B{:x}'.format(media_id(index)) for index in range(count)]
+
+
+def _run_case(name, base_url, api_url):
+    """
+    Esegue un caso e restituisce il numero di media prodotti.
+    """
+    from pyinstagram import AsyncInstagramJsonClient, InstagramApiClient, InstagramJsonClient
+
+    app = InstagramJsonClient(base_url=base_url)
+    if name.startswith('json_hashtag_') and name != 'json_hashtag_parallel':
+        return len(app.get_by_hashtag('bench', top_posts=False, as_=name[len('json_hashtag_'):]))
+    if name == 'json_hashtag_parallel':
+        return len(app.get_by_hashtag(('bench', 'mfw', 'fashion', 'style'), top_posts=False, workers=4,
+                                      as_='records'))
+    if name == 'json_user_records':
+        return len(app.get_by_user('bench', as_='records'))
+    if name == 'json_media_codes':
+        return len(app.get_by_media_codes(_codes(CODES), as_='records'))
+    if name == 'json_comments':
+        return len(app.get_comments_by_media_codes(_codes(CODES), workers=4, as_='records'))
+    if name == 'aio_media_codes':
+        import asyncio
+
+        async def fetch():
+            async with AsyncInstagramJsonClient(concurrency=10, base_url=base_url) as client:
+                return await client.get_by_media_codes(_codes(CODES))
+        return len(asyncio.run(fetch()))
+    if name == 'scheduler_hashtag':
+        import functools
+        import tempfile
+        from pyinstagram import Scheduler
+        with tempfile.TemporaryDirectory() as directory:
+            scheduler = Scheduler(os.path.join(directory, 'queue.db'), processes=2, threads=4, discover=True,
+                                  client_factory=functools.partial(InstagramJsonClient, base_url=base_url),
+                                  poll_interval=0.1)
+            scheduler.add_tags(('bench', 'mfw', 'fashion', 'style'))
+            media = scheduler.run()['items']
+            scheduler.close()
+            return media
+    api = InstagramApiClient("benchmark", api_url=api_url)
+    if name == 'api_hashtag':
+        return len(api.get_by_hashtag('bench'))
+    if name == 'api_user':
+        return len(api.get_by_user('self'))
+    raise ValueError("Caso sconosciuto: {}".format(name))
+
+
+def child(name, base_url, api_url):
+    """
+    Esegue un caso nel processo corrente e ne stampa le misure in json.
+    """
+    import pyinstagram  # noqa: F401 (la memoria della libreria non va attribuita al caso)
+    baseline = _max_rss()
+    start = time.perf_counter()
+    media = _run_case(name, base_url, api_url)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'media': media, 'seconds': seconds, 'rss': _max_rss() - baseline}))
+
+
+def import_time(repeat=5):
+    """
+    :return: float - tempo mediano (secondi) di "import pyinstagram" in un processo nuovo
+    """
+    code = "import time; t = time.perf_counter(); import pyinstagram; print(time.perf_counter() - t)"
+    samples = [
+        float(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=_env()))
+        for _ in range(repeat)
+    ]
+    return statistics.median(samples)
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def main(argv=None):
+    from benchmarks.server import StandInServer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20, help="pagine per utente e per hashtag")
+    parser.add_argument('--page-size', type=int, default=50, help="media per pagina")
+    parser.add_argument('--comments', type=int, default=40, help="commenti per post")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="un 429 ogni N richieste")
+    parser.add_argument('--repeat', type=int, default=3, help="ripetizioni di ogni caso (vale la mediana)")
+    parser.add_argument('--cases', default=','.join(CASES), help="casi da eseguire, separati da virgola")
+    parser.add_argument('--fixtures', help="cartella con le risposte registrate (vedi benchmarks.fixtures)")
+    parser.add_argument('--output', help="file in cui salvare i risultati in json")
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        return child(args.case, args.base_url, args.api_url)
+
+    results = {'import_seconds': import_time(), 'cases': {}}
+    print("import pyinstagram: {:.1f} ms\n".format(results['import_seconds'] * 1000))
+    print("{:<24}{:>10}{:>12}{:>12}{:>16}".format("caso", "media", "pagine/s", "media/s", "MB RSS / 10k"))
+    server = StandInServer(pages=args.pages, page_size=args.page_size, comments=args.comments,
+                           rate_limit_every=args.rate_limit_every, fixtures=args.fixtures)
+    with server:
+        for name in args.cases.split(','):
+            runs = []
+            for _ in range(args.repeat):
+                server.reset()
+                output = subprocess.check_output([
+                    sys.executable, '-m', 'benchmarks.run', '--case', name,
+                    '--base-url', server.base_url, '--api-url', server.api_url
+                ], cwd=ROOT, env=_env())
+                run = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+                run['pages'] = server.requests
+                runs.append(run)
+            seconds = statistics.median(run['seconds'] for run in runs)
+            media = runs[0]['media']
+            result = {
+                'media': media,
+                'pages': runs[0]['pages'],
+                'seconds': seconds,
+                'pages_per_second': runs[0]['pages'] / seconds,
+                'media_per_second': media / seconds,
+                'rss_mb_per_10k': statistics.median(run['rss'] for run in runs) / 1024 / 1024 * 10000 / max(media, 1),
+            }
+            results['cases'][name] = result
+            print("{:<24}{:>10}{:>12.1f}{:>12.1f}{:>16.2f}".format(
+                name, media, result['pages_per_second'], result['media_per_second'], result['rss_mb_per_10k']
+            ))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
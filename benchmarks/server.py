@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Server HTTP locale che imita gli endpoint usati dalla libreria, per
+misurare (e provare) i client senza contattare Instagram:
+
+  - /<user>?__a=1 e /<user>/?__a=1              profilo e post di un utente
+  - /explore/tags/<tag>?__a=1                   post di un hashtag
+  - /p/<code>?__a=1                             post e commenti
+  - /v1/users/<id>/media/recent/                API ufficiale, post di un utente
+  - /v1/tags/<tag>/media/recent                 API ufficiale, post di un hashtag
+  - /v1/tags/search                             API ufficiale, ricerca hashtag
+
+Le risposte sono generate in modo deterministico (stessi parametri,
+stessi dati) e paginate; i nomi che iniziano con "missing" restituiscono
+la pagina HTML "Sorry, this page isn't available". Con rate_limit_every
+una richiesta ogni N riceve un 429. Se viene indicata una cartella di
+fixtures (vedi fixtures.py), le risposte registrate hanno la precedenza
+su quelle generate.
+
+Il server risponde anche alle richieste in forma assoluta
+("GET http://host/percorso"), quindi può fare da proxy per provare
+SessionPool: ad esempio un server con rate_limit_every=1 simula un
+proxy limitato da Instagram.
+
+Esempio:
+
+ >>> with StandInServer(pages=10, page_size=50) as server:
+ >>>     app = InstagramJsonClient(base_url=server.base_url)
+ >>>     app.get_by_hashtag("mfw", top_posts=False)
+"""
+import json
+import os
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from pyinstagram.utils import media_id_to_timestamp, timestamp_to_media_id
+
+from .fixtures import fixture_name
+
+NOT_AVAILABLE = (
+    b"<!DOCTYPE html><html><head><title>Page Not Found &bull; Instagram</title></head>"
+    b"<body><h2>Sorry, this page isn't available.</h2></body></html>"
+)
+
+# data del post più recente; i post successivi sono più vecchi di INTERVAL secondi
+FIRST_TIMESTAMP = 1505000000
+INTERVAL = 600
+
+
+def media_id(index):
+    """
+    Id del post in posizione index: come su Instagram contiene la data
+    di creazione, quindi gli id sono decrescenti.
+    """
+    return timestamp_to_media_id(FIRST_TIMESTAMP - index * INTERVAL)
+
+
+def media_index(value):
+    """Posizione del post con l'id indicato (l'inverso di media_id)"""
+    return int(round((FIRST_TIMESTAMP - media_id_to_timestamp(value)) / INTERVAL))
+
+
+def _seed(name):
+    # hash() di Python cambia a ogni esecuzione, crc32 no
+    return zlib.crc32(name.encode('utf-8')) & 0xffff
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInServer(object):
+    """
+    Server locale in esecuzione in un thread.
+    """
+    def __init__(self, pages=5, page_size=20, comments=40, comment_page_size=20,
+                 rate_limit_every=0, fixtures=None, port=0, comments_newest_first=False):
+        """
+        :param pages: int - pagine di risultati per utente e per hashtag
+        :param page_size: int - post per pagina
+        :param comments: int - commenti per post
+        :param comment_page_size: int - commenti per pagina
+        :param rate_limit_every: int - risponde 429 a una richiesta ogni N (0 = mai)
+        :param fixtures: str - cartella con le risposte registrate
+        :param port: int - porta (0 = una porta libera)
+        :param comments_newest_first: bool - commenti dal più recente al più vecchio (di default
+                                             dal più vecchio, come nella pagina di un post)
+        """
+        self.pages = pages
+        self.page_size = page_size
+        self.comments = comments
+        self.comment_page_size = comment_page_size
+        self.comments_newest_first = comments_newest_first
+        self.rate_limit_every = rate_limit_every
+        self.fixtures = fixtures
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        server = self
+        handler = type('Handler', (_Handler, ), {'stand_in': server})
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}/".format(self._httpd.server_port)
+
+    @property
+    def api_url(self):
+        return self.base_url + "v1/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        """Azzera i contatori delle richieste"""
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # generazione dei dati
+
+    def _offset(self, cursor):
+        """Indice del primo post della pagina a partire dal cursore (max_id)"""
+        if not cursor:
+            return 0
+        # il primo post con id minore del cursore, che può anche non essere un id esistente
+        index = max(0, media_index(cursor))
+        while media_id(index) >= int(cursor):
+            index += 1
+        return index
+
+    def _media(self, index, seed):
+        return {
+            'id': str(media_id(index)),
+            'code': 'B{:x}'.format(media_id(index)),
+            'timestamp': FIRST_TIMESTAMP - index * INTERVAL,
+            'owner': str(1000 + seed % 97),
+            'likes': (index * 7919 + seed) % 5000,
+            'comments': self.comments,
+            'caption': "post {} #bench #mfw #fashion".format(index),
+            'is_video': index % 10 == 0,
+            'url': "https://scontent.example/{}_n.jpg".format(media_id(index)),
+        }
+
+    def _page(self, cursor, seed):
+        start = self._offset(cursor)
+        end = min(start + self.page_size, self.pages * self.page_size)
+        return [self._media(index, seed) for index in range(start, end)], end < self.pages * self.page_size
+
+    @staticmethod
+    def _resources(m):
+        return [
+            {'src': m['url'].replace('_n', '_s{}'.format(size)), 'config_width': size, 'config_height': size}
+            for size in (150, 240, 320, 480)
+        ]
+
+    def user_page(self, user, cursor):
+        items, _ = self._page(cursor, _seed(user))
+        return {'user': {
+            'username': user,
+            'id': str(1000 + len(user)),
+            'followed_by': {'count': 12345},
+            'media': {'nodes': [{
+                'id': m['id'],
+                'code': m['code'],
+                'date': m['timestamp'],
+                'owner': {'id': m['owner']},
+                'likes': {'count': m['likes']},
+                'comments': {'count': m['comments']},
+                'caption': m['caption'],
+                'is_video': m['is_video'],
+                'display_src': m['url'],
+                'dimensions': {'width': 1080, 'height': 1080},
+                'thumbnail_resources': self._resources(m),
+            } for m in items]},
+        }}
+
+    def _graph_node(self, m):
+        return {
+            'id': m['id'],
+            'shortcode': m['code'],
+            'taken_at_timestamp': m['timestamp'],
+            'owner': {'id': m['owner']},
+            'edge_liked_by': {'count': m['likes']},
+            'edge_media_to_comment': {'count': m['comments']},
+            'edge_media_to_caption': {'edges': [{'node': {'text': m['caption']}}]},
+            'is_video': m['is_video'],
+            'display_src': m['url'],
+            'dimensions': {'width': 1080, 'height': 1080},
+            'thumbnail_resources': self._resources(m),
+        }
+
+    def tag_page(self, tag, cursor):
+        items, has_next = self._page(cursor, _seed(tag))
+        edges = [{'node': self._graph_node(m)} for m in items]
+        return {'graphql': {'hashtag': {
+            'name': tag,
+            'edge_hashtag_to_top_posts': {'edges': edges[:9]},
+            'edge_hashtag_to_media': {
+                'count': self.pages * self.page_size,
+                'edges': edges,
+                'page_info': {'has_next_page': has_next, 'end_cursor': items[-1]['id'] if items else None},
+            },
+        }}}
+
+    def post_page(self, code, cursor):
+        index = media_index(int(code[1:], 16))
+        m = self._media(index, 0)
+        start = int(cursor) if cursor else 0
+        end = min(start + self.comment_page_size, self.comments)
+        node = self._graph_node(m)
+        node.pop('display_src')
+        node.pop('edge_liked_by')
+        node['display_url'] = m['url']
+        node['edge_media_preview_like'] = {'count': m['likes']}
+        node['edge_media_to_comment'] = {
+            'count': self.comments,
+            'edges': [{'node': {
+                'id': m['id'] + str(n),
+                'text': "commento {}".format(n),
+                'created_at': m['timestamp'] + (self.comments - 1 - n if self.comments_newest_first else n) * 60,
+                'owner': {'id': str(2000 + n), 'username': "user{}".format(n)},
+            }} for n in range(start, end)],
+            'page_info': {'has_next_page': end < self.comments, 'end_cursor': str(end)},
+        }
+        return {'graphql': {'shortcode_media': node}}
+
+    def api_page(self, kind, name, cursor, count, token='x'):
+        items, has_next = self._page(cursor, _seed(name))
+        if count:
+            items = items[:count]
+        data = [{
+            'id': "{}_{}".format(m['id'], m['owner']),
+            'created_time': str(m['timestamp']),
+            'user': {'id': m['owner']},
+            'likes': {'count': m['likes']},
+            'comments': {'count': m['comments']},
+            'caption': {'text': m['caption']},
+            'type': 'video' if m['is_video'] else 'image',
+            'link': "https://www.instagram.com/p/{}/".format(m['code']),
+            'images': {
+                'thumbnail': {'url': m['url'], 'width': 150, 'height': 150},
+                'low_resolution': {'url': m['url'], 'width': 320, 'height': 320},
+                'standard_resolution': {'url': m['url'], 'width': 640, 'height': 640},
+            },
+            'tags': ['bench', 'mfw', 'fashion'],
+        } for m in items]
+        pagination = {}
+        if has_next and items:
+            # come Instagram, next_url contiene l'access token della richiesta
+            pagination['next_url'] = "{api}{kind}/{name}/media/recent?access_token={token}&max_id={cursor}".format(
+                api=self.api_url, kind=kind, name=name, token=token, cursor=items[-1]['id'].split('_')[0]
+            )
+        return {'data': data, 'pagination': pagination, 'meta': {'code': 200}}
+
+    def tag_search(self, query):
+        return {'data': [
+            {'name': query + suffix, 'media_count': (n + 1) * 1000}
+            for n, suffix in enumerate(('', 'fashion', 'week', 'style', 'milano'))
+        ], 'meta': {'code': 200}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stand_in = None
+    protocol_version = 'HTTP/1.1'
+    # risposte piccole e keep-alive: senza TCP_NODELAY ogni richiesta attende il delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        server = self.stand_in
+        with server._lock:
+            server.bytes += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data):
+        self._send(200, json.dumps(data).encode('utf-8'))
+
+    def do_GET(self):
+        server = self.stand_in
+        with server._lock:
+            server.requests += 1
+            number = server.requests
+        if server.rate_limit_every and number % server.rate_limit_every == 0:
+            return self._send(429, b'{"meta": {"code": 429}}', headers={'Retry-After': '0'})
+        if server.fixtures:
+            path = os.path.join(server.fixtures, fixture_name(self.path))
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    status, body = int(f.readline()), f.read()
+                # la paginazione delle API deve continuare sul server locale
+                body = body.replace(b'https://api.instagram.com/', server.base_url.encode('ascii'))
+                return self._send(status, body)
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        cursor = query.get('max_id')
+        if any(part.startswith('missing') for part in parts):
+            return self._send(404, NOT_AVAILABLE, 'text/html')
+        if parts[:1] == ['v1']:
+            return self._api(parts[1:], query)
+        if parts[:2] == ['explore', 'tags'] and len(parts) == 3:
+            return self._json(server.tag_page(parts[2], cursor))
+        if parts[:1] == ['p'] and len(parts) == 2:
+            return self._json(server.post_page(parts[1], cursor))
+        if len(parts) == 1:
+            return self._json(server.user_page(parts[0], cursor))
+        self._send(404, NOT_AVAILABLE, 'text/html')
+
+    def _api(self, parts, query):
+        server = self.stand_in
+        headers = {'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '4999'}
+        if parts[-2:] == ['media', 'recent'] and len(parts) == 4 and parts[0] in ('users', 'tags'):
+            data = server.api_page(parts[0], parts[1], query.get('max_id'), int(query.get('count', 0)),
+                                   query.get('access_token', 'x'))
+        elif parts == ['tags', 'search']:
+            data = server.tag_search(query.get('q', ''))
+        else:
+            return self._send(400, json.dumps({'meta': {'error_message': 'unknown endpoint'}}).encode('utf-8'))
+        self._send(200, json.dumps(data).encode('utf-8'), headers=headers)
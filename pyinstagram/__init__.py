@@ -26,8 +26,22 @@ Esempi di utilizzo:
  >>>   print(m['display_src'])
 
 """
+from .aio import AsyncInstagramJsonClient
 from .base import InstagramApiClient, InstagramJsonClient
+from .cache import ResponseCache
+from .checkpoint import CheckpointStore
+from .columnar import MediaColumns
+from .download import MediaDownloader
+from .extract import RenditionPolicy
+from .metrics import Metrics, RequestEvent
+from .model import CommentRecord, MediaRecord
 from .oauth import OAuth
+from .ratelimit import RateLimiter, TokenPool
+from .retry import RetryPolicy
+from .scheduler import JobQueue, Scheduler
+from .seen import BloomSeenIndex, SeenIndex, SQLiteSeenIndex
+from .sinks import DatabaseSink, NDJSONSink
+from .transport import SessionPool, Transport
 
 __title__ = 'pyinstagram'
 __description__ = 'Instagram HTTP wrapper for Python Developers.'
@@ -38,4 +52,10 @@ __author_url__ = 'http://www.alessandrocucci.it/'
 __license__ = 'MIT'
 __copyright__ = 'Copyright 2017 Alessandro Cucci'
 
-__all__ = ['OAuth', 'InstagramApiClient', 'InstagramJsonClient']
+__all__ = [
+    'OAuth', 'InstagramApiClient', 'InstagramJsonClient', 'AsyncInstagramJsonClient', 'Transport',
+    'RateLimiter', 'ResponseCache', 'CheckpointStore', 'DatabaseSink', 'MediaRecord',
+    'MediaColumns', 'NDJSONSink', 'MediaDownloader', 'RenditionPolicy', 'CommentRecord',
+    'SeenIndex', 'BloomSeenIndex', 'SQLiteSeenIndex', 'Metrics', 'RequestEvent',
+    'TokenPool', 'SessionPool', 'RetryPolicy', 'JobQueue', 'Scheduler',
+]
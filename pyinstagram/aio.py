@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Client asincrono (asyncio) per InstagramJsonClient.
+
+Le richieste HTTP continuano a passare da requests, ma vengono
+eseguite in un pool di thread che condivide un'unica sessione
+(e quindi un unico pool di connessioni keep-alive). La dimensione
+del pool limita il numero di richieste contemporanee verso Instagram.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .base import InstagramJsonClient
+from .transport import Transport
+
+
+class AsyncInstagramJsonClient(object):
+    """
+    Versione asincrona di InstagramJsonClient: espone gli stessi
+    metodi come coroutine, permettendo di scaricare molti post,
+    profili o hashtag in parallelo.
+
+    Esempio:
+
+     >>> async def main():
+     ...     async with AsyncInstagramJsonClient(concurrency=20) as app:
+     ...         return await app.get_by_media_codes(codes)
+     >>> media = asyncio.run(main())
+    """
+    def __init__(self, concurrency=10, transport=None, **kwargs):
+        """
+        :param concurrency: int - numero massimo di richieste contemporanee
+        :param transport: Transport - strato di trasporto HTTP condiviso
+        :param kwargs: gli altri parametri (cache, checkpoints, json_loads, rendition,
+            seen, base_url, hooks, retry, ...) vengono passati a InstagramJsonClient
+        """
+        self.concurrency = concurrency
+        # il pool di connessioni deve poter servire tutte le richieste contemporanee
+        self.transport = transport or Transport(pool_maxsize=concurrency)
+        self._client = InstagramJsonClient(transport=self.transport, **kwargs)
+        # il numero di thread è anche il limite di richieste contemporanee
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Esegue un metodo bloccante del client nel pool di thread
+        dell'istanza, che limita le richieste contemporanee.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def get_user_info(self, user):
+        """
+        Ritorna le informazioni di un utente
+        :param user: username Instagram
+        :return: dizionario con le info dell'utente
+        """
+        return await self._run(self._client.get_user_info, user)
+
+    async def get_by_user(self, user, count=None, since=None, until=None):
+        """
+        Ricerca post (pubblici) di un utente, vedi InstagramJsonClient.get_by_user.
+
+        :param user: str - username Instagram
+        :param count: int - limita il numero di risultati
+        :param since: str - Risultati a partire da questa data, es. "20170101000000"
+        :param until: str - Risultati entro questa data, es. "20171231235959"
+        :return: list - lista di dizionari
+        """
+        return await self._run(self._client.get_by_user, user, count, since, until)
+
+    async def get_by_hashtag(self, tags=(), count=1000000, top_posts=True, since=None, until=None):
+        """
+        Ricerca per hashtag, vedi InstagramJsonClient.get_by_hashtag.
+        Gli hashtag vengono scaricati in parallelo, ma i risultati
+        mantengono l'ordine degli hashtag richiesti.
+
+        :param tags: str or tuple - hashtag (senza il #) o tupla di hastag
+        :param count: int - limita i risultati
+        :param top_posts: bool - limita ai top posts altrimenti ritorna tutto
+        :param since: str - Risultati a partire da questa data, es. "20170101000000"
+        :param until: str - Risultati entro questa data, es. "20171231235959"
+        :return: list - lista di oggetti Media
+        """
+        if isinstance(tags, str):
+            tags = (tags, )
+        results = await asyncio.gather(*(
+            self._run(self._client.get_by_hashtag, tag, count, top_posts, since, until)
+            for tag in tags
+        ))
+        return [media for result in results for media in result][:count]
+
+    async def get_by_media_codes(self, codes=(), all_comments=False):
+        """
+        Restituisce i dati dei post richiesti, vedi
+        InstagramJsonClient.get_by_media_codes. I post vengono
+        scaricati in parallelo; i post non più raggiungibili
+        vengono saltati.
+
+        :param codes: stringa del codice o tupla con i codici dei post
+        :param all_comments: bool - se attivato, scarica tutti i commenti
+        :return: lista di json con i dati dei post richiesti
+        """
+        if isinstance(codes, str):
+            codes = (codes,)
+        results = await asyncio.gather(*(
+            self._run(self._client.get_by_media_codes, code, all_comments)
+            for code in codes
+        ))
+        return [res for result in results for res in result]
+
+    def close(self):
+        """Chiude il pool di thread e le connessioni aperte"""
+        self._executor.shutdown(wait=True)
+        self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
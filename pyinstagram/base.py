@@ -1,63 +1,394 @@
 # -*- coding: utf-8 -*-
-import random
+import re
+import threading
 from datetime import datetime
-from operator import itemgetter
+from itertools import chain
+from operator import attrgetter, itemgetter
 
-import requests
 import time
 
-from pyinstagram.model import Media
 from .exceptions import OAuthException, PyInstagramException
 from .oauth import OAuth
+from .cache import CachedResponse
+from .columnar import MediaColumns
 from .constants import API_URL
-from .utils import DESAdapter
+from . import jsonlib
+from .metrics import RequestEvent
+from .extract import CommentConverter, Converter, HASHTAG_FIELDS, POST_FIELDS, USER_FIELDS
+from .ratelimit import RateLimiter, TokenPool
+from .retry import NOT_AVAILABLE, RETRY, RetryPolicy
+from .transport import Transport
+from .utils import Deferred, _close, iter_parallel, take, timestamp_to_media_id
 
 
-class InstagramApiClient(object):
+def _parse_date(value, name):
     """
-    Classe base per le chiamate all'API ufficiale!
+    Converte in datetime una data nel formato "20170101000000".
+
+    :param value: str - data da convertire (o None)
+    :param name: str - nome del parametro, usato nel messaggio d'errore
+    :return: datetime o None
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y%m%d%H%M%S")
+    except ValueError:
+        raise ValueError("Il parametro {} non è in un formato corretto (es. '20170101000000')".format(name))
+
+
+def _timestamp(date):
     """
-    def __init__(self, access_token=None):
-        self.access_token = access_token
-        if isinstance(access_token, OAuth):
-            self.access_token = access_token.access_token
-        if not self.access_token:
-            # TODO: Gestire il caso in cui l'access token scada
-            raise OAuthException("Per usare la libreria devi prima autenticarti!")
+    :param date: datetime - data (ora locale) o None
+    :return: float - Unix Timestamp o None
+    """
+    return time.mktime(date.timetuple()) if date else None
+
 
-    @staticmethod
-    def go_to_sleep(seconds=3600):
+def _seek_id(until, seek, max_id):
+    """
+    Cursore da cui iniziare una ricerca limitata da until: gli id
+    dei media contengono la data di creazione, quindi si può saltare
+    direttamente ai post precedenti a until invece di scorrere tutti
+    quelli più recenti.
+
+    :param until: float - Unix Timestamp della data massima (o None)
+    :param seek: bool - modalità seek richiesta
+    :param max_id: str - cursore salvato (ha la precedenza)
+    :return: int - max_id da usare per la prima pagina, o None
+    """
+    if not seek or until is None or max_id:
+        return None
+    # +1: i post creati nello stesso secondo di until vanno inclusi
+    return timestamp_to_media_id(until + 1)
+
+
+def _check_columns(sink, fields):
+    """
+    as_='columns' restituisce un unico oggetto MediaColumns con le
+    colonne predefinite: non può essere scritto in un sink né avere
+    campi aggiuntivi.
+    """
+    if sink is not None:
+        raise ValueError("Il parametro sink non si può usare con as_='columns'")
+    if fields:
+        raise ValueError("Il parametro fields non si può usare con as_='columns'")
+
+
+def _check_fields(as_, fields):
+    """
+    I campi aggiuntivi vengono restituiti solo con as_='dict': gli
+    oggetti Media e MediaRecord hanno solo i campi del model e il
+    json originale non viene modificato.
+    """
+    if fields and as_ != 'dict':
+        raise ValueError("Il parametro fields si può usare solo con as_='dict', non con as_='{}'".format(as_))
+
+
+def _iter_new(items, checkpoints, source, key):
+    """
+    Sincronizzazione incrementale: restituisce i media di un flusso
+    (ordinato dal più recente) fermandosi al primo già visto in una
+    ricerca precedente. Il media più recente visto, che farà da limite
+    per la ricerca successiva, viene salvato solo se il flusso arriva
+    al limite precedente o alla sua fine: se il chiamante smette prima
+    di leggere (es. raggiunto count) i media più vecchi non ancora letti
+    andrebbero persi, quindi il limite resta quello precedente.
+
+    :param items: iterable - flusso di media
+    :param checkpoints: CheckpointStore - archivio in cui salvare il limite
+    :param source: str - sorgente della ricerca
+    :param key: callable - estrae (id, timestamp) da un media
+    :return: generator - solo i media nuovi
+    """
+    if checkpoints is None:
+        raise PyInstagramException("Per la sincronizzazione incrementale serve un CheckpointStore")
+    mark = checkpoints.get_mark(source)
+    newest = None
+    try:
+        for item in items:
+            if isinstance(item, Deferred):
+                yield item
+                continue
+            media_id, timestamp = key(item)
+            timestamp = int(timestamp)
+            if mark and (str(media_id) == mark[0] or timestamp < mark[1]):
+                # da qui in poi ho già tutto, smetto di paginare
+                break
+            if newest is None or timestamp > newest[1]:
+                newest = (media_id, timestamp)
+            yield item
+    finally:
+        _close(items)
+    if newest is not None:
+        # eseguito solo se il chiamante legge fin qui (anche con iter_parallel)
+        yield Deferred(checkpoints.set_mark, source, *newest)
+
+
+class _SeenSession(object):
+    """
+    Post di una ricerca riservati su un SeenIndex. Gli id vengono
+    riservati dai generatori delle pagine, anche in thread diversi
+    (iter_parallel), ma segnati come visti solo quando il post arriva
+    al chiamante; alla chiusura della ricerca gli id riservati e mai
+    restituiti vengono liberati, così da essere restituiti la volta
+    successiva.
+    """
+    # id restituiti dopo i quali aggiorno l'indice
+    COMMIT_EVERY = 100
+
+    def __init__(self, seen, convert):
         """
-        Questo metodo viene chiamato quando è stato raggiunto il
-        limite consentito dall'API, se succede metto in pausa il
-        programma per un'ora.
+        :param seen: SeenIndex - indice degli id già visti
+        :param convert: Converter - formato dei post restituiti
+        """
+        self.seen = seen
+        self._key = itemgetter('id') if convert.as_ in ('json', 'dict') else attrgetter('id')
+        self._lock = threading.Lock()
+        self._claimed = set()
+        self._delivered = []
+        self._closed = False
 
-        :param seconds: int - Numero di secondi di attesa
-        :return: None
+    def claim(self, ids):
         """
-        time.sleep(seconds)
+        :param ids: list - id dei post di una pagina
+        :return: list - True per ogni post da restituire
+        """
+        with self._lock:
+            if self._closed:
+                # la ricerca è terminata, il thread sta solo finendo la pagina
+                return [False] * len(ids)
+            new = self.seen.claim(ids)
+            self._claimed.update(str(media_id) for media_id, is_new in zip(ids, new) if is_new)
+            return new
+
+    def deliver(self, items):
+        """
+        Lato chiamante: segna come visti i post man mano che vengono
+        restituiti.
 
-    def _make_request(self, uri, method='get', data=None):
+        :param items: iterable - flusso dei post
+        :return: generator
+        """
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not isinstance(item, Deferred):
+                    self._delivered.append(str(self._key(item)))
+                    if len(self._delivered) >= self.COMMIT_EVERY:
+                        self._commit()
+                yield item
+        finally:
+            _close(iterator)
+            self.close()
+
+    def _commit(self):
+        with self._lock:
+            ids, self._delivered = self._delivered, []
+            self._claimed.difference_update(ids)
+        self.seen.commit(ids)
+
+    def close(self):
+        self._commit()
+        with self._lock:
+            self._closed = True
+            ids, self._claimed = list(self._claimed), set()
+        self.seen.release(ids)
+
+
+def _convert_page(convert, nodes, seen):
+    """
+    Converte i post di una pagina saltando quelli già visti (prima
+    della creazione dei model).
+
+    :param convert: Converter - conversione nel formato richiesto
+    :param nodes: list - json dei post della pagina
+    :param seen: _SeenSession - post riservati dalla ricerca (None = nessun filtro)
+    :return: generator - post nel formato richiesto
+    """
+    if seen is not None:
+        new = seen.claim([node['id'] for node in nodes])
+        nodes = [node for node, is_new in zip(nodes, new) if is_new]
+    return convert.convert_many(nodes)
+
+
+def _seen_session(seen, convert):
+    """
+    :param seen: SeenIndex - indice del client (o None)
+    :param convert: Converter - formato dei post restituiti
+    :return: _SeenSession - o None se il client non ha un indice
+    """
+    return _SeenSession(seen, convert) if seen is not None else None
+
+
+def _notify(hooks, event):
+    """
+    Passa l'evento di una richiesta a tutti gli hook registrati.
+
+    :param hooks: list - funzioni che ricevono un RequestEvent
+    :param event: RequestEvent - misure della richiesta
+    :return: None
+    """
+    for hook in hooks:
+        hook(event)
+
+
+def _sync_key(convert, raw_key):
+    """
+    :param convert: Converter - formato di output dei media
+    :param raw_key: callable - estrae (id, timestamp) dal json originale
+    :return: callable - estrae (id, timestamp) da un media nel formato di output
+    """
+    if convert.as_ == 'json':
+        return raw_key
+    if convert.as_ == 'dict':
+        return itemgetter('id', 'unix_datetime')
+    return attrgetter('id', 'unix_datetime')
+
+
+_TOKEN = re.compile(r'([?&])access_token=([^&]*)')
+
+
+def _url_token(url):
+    """
+    :param url: str - url delle API
+    :return: str - access token contenuto nell'url, None se assente
+    """
+    match = _TOKEN.search(url)
+    return match.group(2) if match else None
+
+
+def _with_token(url, token):
+    """
+    :param url: str - url delle API
+    :param token: str - access token da usare
+    :return: str - url con l'access token indicato
+    """
+    if _TOKEN.search(url):
+        return _TOKEN.sub(lambda match: "{0}access_token={1}".format(match.group(1), token), url, count=1)
+    return url + ("&" if "?" in url else "?") + "access_token=" + token
+
+
+class InstagramApiClient(object):
+    """
+    Classe base per le chiamate all'API ufficiale!
+    """
+    def __init__(self, access_token=None, transport=None, rate_limiter=None, checkpoints=None, json_loads=None,
+                 api_url=None, hooks=None, retry=None):
+        """
+        :param access_token: str, OAuth, list or TokenPool - access token (o oggetto OAuth
+                                                             autenticato), o più token tra cui
+                                                             distribuire le richieste
+        :param transport: Transport - strato di trasporto HTTP (di default quello
+                                      dell'oggetto OAuth, o uno nuovo)
+        :param rate_limiter: RateLimiter - limite di richieste, da condividere tra i
+                                           client che usano lo stesso access token
+                                           (con un solo token)
+        :param checkpoints: CheckpointStore - archivio usato dalla sincronizzazione incrementale
+        :param json_loads: callable - funzione di decodifica JSON (di default orjson o
+                                      simdjson se installate, altrimenti json)
+        :param api_url: str - indirizzo base delle API (di default quello di Instagram,
+                              utile per puntare a un server locale nei test)
+        :param hooks: list - funzioni chiamate con un RequestEvent dopo ogni richiesta
+                             (es. un oggetto Metrics)
+        :param retry: RetryPolicy - regole per ripetere le richieste fallite (429, 5xx, errori di rete)
+        """
+        self.api_url = api_url or API_URL
+        self.hooks = list(hooks or ())
+        self.retry = retry or RetryPolicy()
+        self.transport = transport
+        if isinstance(access_token, TokenPool):
+            self.tokens = access_token
+        else:
+            if not isinstance(access_token, (list, tuple)):
+                access_token = [access_token]
+            tokens = []
+            for token in access_token:
+                if isinstance(token, OAuth):
+                    self.transport = self.transport or token.transport
+                    token = token.access_token
+                if not token:
+                    # TODO: Gestire il caso in cui l'access token scada
+                    raise OAuthException("Per usare la libreria devi prima autenticarti!")
+                tokens.append(token)
+            if len(tokens) == 1:
+                tokens = [(tokens[0], rate_limiter or RateLimiter())]
+            self.tokens = TokenPool(tokens)
+        self.access_token = self.tokens.tokens[0]
+        self.rate_limiter = self.tokens.limiter(self.access_token)
+        self.transport = self.transport or Transport()
+        self.checkpoints = checkpoints
+        self.loads = json_loads or jsonlib.loads
+
+    def _make_request(self, uri, method='get', data=None, kind=None, budget=None):
         """
         Metodo che effettua la richiesta alle API Instagram.
 
+        Ogni richiesta usa il token con più quota residua (o quello
+        già presente nell'url, per le pagine successive di una
+        ricerca, se ha ancora quota) e attende il proprio turno nel
+        suo rate limiter; se le API rispondono comunque 429, si
+        aspetta solo il tempo necessario e si riprova, al massimo
+        retry.max_attempts volte e nei limiti del budget della ricerca.
+
         :param uri: str - L'Uri da chiamare
         :param method: str - metodo http con cui fare la richiesta
         :param data: dict - dizionario con i dati da passare nella richiesta
+        :param kind: str - tipo di endpoint ('user', 'tag', 'search'), riportato negli eventi
+        :param budget: RetryBudget - budget di ripetizioni della ricerca
         :return: list - lista di dati di risposta
         """
-        next_url = ""  # per la paginazione
-        res = []
-        retry = 1  # serve per ripetere la chiamata dopo un ora se supero il limite di richieste
-        while retry:
-            res = getattr(requests, method)(uri, data=data)
-            res, next_url = self._handle_response(res)
-            if res == 0:
-                # la chiamata non è andata a buon fine perchè ho raggiunto il limite di chiamate
-                # ho già aspettato un'ora, adesso ci riprovo.
+        # retries conta tutti i tentativi ripetuti, failures gli errori (5xx, rete) e
+        # throttled i 429: l'attesa dopo un 429 la decide il rate limiter, ma anche
+        # i 429 hanno un limite di tentativi e consumano il budget della ricerca
+        retries = failures = throttled = 0
+        wait = 0.0
+        while True:
+            token = self.tokens.choose(_url_token(uri))
+            uri = _with_token(uri, token)
+            rate_limiter = self.tokens.limiter(token)
+            sleep = wait + rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                res = self.transport.request(method, uri, data=data)
+            except Exception as e:
+                if self.retry.classify(exception=e) != RETRY or not self.retry.allow(failures + 1, budget):
+                    raise
+                retries += 1
+                failures += 1
+                wait = self.retry.delay(failures)
+                time.sleep(wait)
                 continue
-            retry = 0
-        return res, next_url
+            latency = time.perf_counter() - start
+            rate_limiter.update(res.headers)
+            if self.retry.classify(res) == RETRY:
+                if self.hooks:
+                    _notify(self.hooks, RequestEvent(kind, uri, res.status_code, latency, len(res.content),
+                                                     retries=retries, sleep=sleep))
+                retries += 1
+                if res.status_code == 429:
+                    # OAuthRateLimitException: ho raggiunto il limite di chiamate,
+                    # l'attesa avviene nel rate limiter alla prossima acquire()
+                    if not self.retry.allow(throttled + 1, budget):
+                        raise PyInstagramException("Troppe risposte 429 per l'indirizzo: {}".format(uri))
+                    throttled += 1
+                    rate_limiter.backoff(res.headers.get('Retry-After'))
+                    wait = 0.0
+                    continue
+                if not self.retry.allow(failures + 1, budget):
+                    raise PyInstagramException("Troppi tentativi falliti ({}) per l'indirizzo: {}".format(
+                        res.status_code, uri))
+                failures += 1
+                wait = self.retry.delay(failures, res.headers.get('Retry-After'))
+                time.sleep(wait)
+                continue
+            start = time.perf_counter()
+            try:
+                return self._handle_response(res)
+            finally:
+                if self.hooks:
+                    _notify(self.hooks, RequestEvent(kind, uri, res.status_code, latency, len(res.content),
+                                                     time.perf_counter() - start, retries, sleep))
 
     def _handle_response(self, request):
         """
@@ -65,9 +396,8 @@ class InstagramApiClient(object):
         interpretarne la risposta.
 
         Se la richiesta è andata a buon fine, restituiamo la
-        lista dei dati, altrimenti o mettiamo in pausa il
-        programma (se abbiamo raggiunto il limite dell'API)
-        o solleviamo un'eccezione appropriata.
+        lista dei dati, altrimenti solleviamo un'eccezione
+        appropriata.
 
         :param request: requests - la risposta della chiamata
         :return: list - lista dei dati ricevuti
@@ -75,7 +405,7 @@ class InstagramApiClient(object):
         if request.status_code == 200:
             # Tutto ok!
             try:
-                res = request.json()
+                res = self.loads(request.content)
             except Exception:
                 raise Exception(request.text)
             else:
@@ -83,18 +413,61 @@ class InstagramApiClient(object):
                 next_url = res.get('pagination', {}).get('next_url')
                 return data, next_url
 
-        elif request.status_code == 429:
-            # OAuthRateLimitException
-            self.go_to_sleep()
-            return 0
         elif request.status_code == 400:
-            raise OAuthException(request.json()['meta']['error_message'])
+            raise OAuthException(self.loads(request.content)['meta']['error_message'])
         elif "<!DOCTYPE html>" in request.text:
             raise PyInstagramException("Page not found")
         else:
             raise PyInstagramException
 
-    def get_by_user(self, id_user=None, count=0):
+    def _iter_media(self, url, count=0, kind=None, budget=None):
+        """
+        Generatore che segue la paginazione delle API a partire
+        da un url, restituendo i media uno alla volta man mano
+        che le pagine vengono scaricate.
+
+        :param url: str - url della prima pagina
+        :param count: int - limita a {count} risultati (0 = tutti)
+        :param kind: str - tipo di endpoint, riportato negli eventi
+        :param budget: RetryBudget - budget di ripetizioni della ricerca
+        :return: generator - media
+        """
+        yielded = 0
+        while url:
+            raw_list, url = self._make_request(url, kind=kind, budget=budget)
+            for media in raw_list:
+                yield media
+                yielded += 1
+                if count and yielded >= count:
+                    return
+
+    def _sync(self, items, source):
+        return _iter_new(items, self.checkpoints, "api:" + source,
+                         lambda media: (media['id'], media['created_time']))
+
+    def iter_by_user(self, id_user=None, count=0, sync=False):
+        """
+        Versione "lazy" di get_by_user: restituisce un generatore
+        che produce i post man mano che le pagine vengono scaricate.
+        Interrompere l'iterazione interrompe anche la paginazione.
+
+        :param id_user: str - post dell'utente da cercare
+        :param count: int - limita a {count} risultati
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
+        :return: generator - post dell'utente
+        """
+        budget = self.retry.new_budget()
+        id_user = id_user or "self"
+        url = self.api_url + "users/{0}/media/recent/".format(id_user)
+        if count:
+            url += "?count={}".format(count)
+        if sync:
+            return take(self._sync(self._iter_media(url, kind='user', budget=budget), "user:{}".format(id_user)),
+                        count)
+        return self._iter_media(url, count, 'user', budget)
+
+    def get_by_user(self, id_user=None, count=0, sync=False):
         """
         Metodo usato per cercare gli ultimi post di un utente.
         Se non viene passato il paramentro id_user, chiederemo
@@ -102,43 +475,54 @@ class InstagramApiClient(object):
 
         :param id_user: str - post dell'utente da cercare
         :param count: int - limita a {count} risultati
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
         :return: list - lista dati
         """
-        all_media = []
-        id_user = id_user or "self"
-        url = API_URL + "users/{0}/media/recent/?access_token={1}".format(id_user, self.access_token)
-        if count:
-            url += "&count={}".format(count)
-        raw_list, next_url = self._make_request(url)
-        all_media.extend(raw_list)
-        if len(all_media) > count:
-            return all_media[:count]
-        while next_url:
-            raw_list, next_url = self._make_request(next_url)
-            all_media.extend(raw_list)
-        return all_media[:count]
-
-    def get_by_hashtag(self, tags=(), count=0):
+        return list(self.iter_by_user(id_user, count, sync))
+
+    def iter_by_hashtag(self, tags=(), count=0, workers=1, sync=False):
         """
-        Metodo usato per cercare i post con uno o più hashtag.
+        Versione "lazy" di get_by_hashtag: restituisce un generatore
+        che produce i post man mano che le pagine vengono scaricate.
+        Con workers > 1 gli hashtag vengono scaricati in parallelo
+        e i risultati alternati tra un hashtag e l'altro.
 
         :param tags: iterable - gli hashtag da cercare
         :param count: int - massimo numero di risultati da restituire
-        :return: list - lista di dati
+        :param workers: int - numero di hashtag scaricati in parallelo
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
+        :return: generator - post con gli hashtag richiesti
         """
+        budget = self.retry.new_budget()
         if isinstance(tags, str):
             tags = (tags, )
-        all_media = []
+        streams = []
         for tag in tags:
-            url = API_URL + "tags/{0}/media/recent?access_token={1}".format(tag, self.access_token)
+            url = self.api_url + "tags/{0}/media/recent".format(tag)
             if count:
-                url += "&count={}".format(count)
-            raw_list, next_url = self._make_request(url)
-            all_media.extend(raw_list)
-            while next_url:
-                raw_list, next_url = self._make_request(next_url)
-                all_media.extend(raw_list)
-        return all_media
+                url += "?count={}".format(count)
+            stream = self._iter_media(url, kind='tag', budget=budget)
+            if sync:
+                stream = self._sync(stream, "tag:{}".format(tag))
+            streams.append(stream)
+        if workers > 1:
+            return take(iter_parallel(streams, workers), count)
+        return take(chain.from_iterable(streams), count)
+
+    def get_by_hashtag(self, tags=(), count=0, workers=1, sync=False):
+        """
+        Metodo usato per cercare i post con uno o più hashtag.
+
+        :param tags: iterable - gli hashtag da cercare
+        :param count: int - massimo numero di risultati da restituire
+        :param workers: int - numero di hashtag scaricati in parallelo
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
+        :return: list - lista di dati
+        """
+        return list(self.iter_by_hashtag(tags, count, workers, sync))
 
     def search_for_tag(self, tag, count=3):
         """
@@ -148,8 +532,8 @@ class InstagramApiClient(object):
         :param count: int - limita a un numero di hashtag
         :return: dict
         """
-        url = API_URL + "tags/search?q={0}&access_token={1}".format(tag, self.access_token)
-        res, _ = self._make_request(url)
+        url = self.api_url + "tags/search?q={0}".format(tag)
+        res, _ = self._make_request(url, kind='search', budget=self.retry.new_budget())
         res = sorted(res, key=itemgetter('media_count'))
         names = {r['name']: r['media_count'] for r in res[:count]}
         return names
@@ -160,15 +544,134 @@ class InstagramJsonClient(object):
     Classe per fare semplici richieste in get senza usare access token
     o le API ufficiali. Fa largo uso di url con query string.
     """
-    def __init__(self):
-        self.base_url = "https://www.instagram.com/"
-        self.session = self._init_session()
+    def __init__(self, transport=None, cache=None, checkpoints=None, json_loads=None, raw_json=False,
+                 rendition=None, seen=None, base_url=None, hooks=None, retry=None):
+        """
+        :param transport: Transport or SessionPool - strato di trasporto HTTP (abilita il supporto
+                                                    3DES su Instagram)
+        :param cache: ResponseCache - cache delle pagine di profili, post e hashtag
+        :param checkpoints: CheckpointStore - archivio dei cursori, per riprendere le ricerche interrotte
+        :param json_loads: callable - funzione di decodifica JSON (di default orjson o
+                                      simdjson se installate, altrimenti json)
+        :param raw_json: bool - negli oggetti Media e MediaRecord salva il json del post come
+                                stringa (pronta per il database) invece che come dizionario;
+                                il dizionario resta disponibile, decodificato su richiesta,
+                                nella proprietà data
+        :param rendition: RenditionPolicy - regola per scegliere la risoluzione dell'immagine
+                                            usata come url (di default quella piena)
+        :param seen: SeenIndex - indice dei post già visti, che get_by_user e get_by_hashtag
+                                 saltano (utile con più hashtag o ricerche ripetute)
+        :param base_url: str - indirizzo base del sito (di default quello di Instagram,
+                               utile per puntare a un server locale nei test)
+        :param hooks: list - funzioni chiamate con un RequestEvent dopo ogni richiesta
+                             (es. un oggetto Metrics)
+        :param retry: RetryPolicy - regole per ripetere le richieste fallite (429, 5xx, errori
+                                    di rete); post e hashtag non più esistenti non vengono ripetuti
+        """
+        self.base_url = base_url or "https://www.instagram.com/"
+        self.hooks = list(hooks or ())
+        self.retry = retry or RetryPolicy()
+        self.transport = transport or Transport()
+        self.session = self.transport.session
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.loads = json_loads or jsonlib.loads
+        self.raw_json = raw_json
+        self.rendition = rendition
+        self.seen = seen
 
-    def _init_session(self):
-        """Abilita il supporto 3DES su Instagram"""
-        s = requests.Session()
-        s.mount(self.base_url, DESAdapter())
-        return s
+    def _load_cursor(self, source, resume):
+        """
+        :param source: str - sorgente della ricerca
+        :param resume: bool - se False la ricerca riparte dalla prima pagina
+        :return: str - cursore da cui riprendere ("" per la prima pagina)
+        """
+        if not resume:
+            return ""
+        if self.checkpoints is None:
+            raise PyInstagramException("Per riprendere una ricerca serve un CheckpointStore")
+        return self.checkpoints.get_cursor(source) or ""
+
+    def _save_cursor(self, source, cursor):
+        """
+        Salva il cursore della prossima pagina da scaricare, o lo
+        cancella (cursor None) se la ricerca è terminata.
+        """
+        if self.checkpoints is None:
+            return
+        if cursor is None:
+            self.checkpoints.clear_cursor(source)
+        else:
+            self.checkpoints.set_cursor(source, cursor)
+
+    def _get(self, url, kind=None):
+        """
+        Effettua una richiesta GET. Le pagine di cui è indicato il
+        tipo ('profile', 'post', 'tag') passano dalla cache, se presente.
+
+        :param url: str - url da chiamare
+        :param kind: str - tipo di pagina, None per non usare la cache
+        :return: requests.Response o CachedResponse
+        """
+        if self.cache is None or kind is None:
+            return self.transport.get(url)
+        content = self.cache.get(url)
+        if content is not None:
+            return CachedResponse(url, content)
+        res = self.transport.get(url)
+        if res.status_code == 200 and res.content[:1] == b'{':
+            self.cache.set(url, kind, res.content)
+        return res
+
+    def _fetch(self, url, kind, cache_kind=None, budget=None):
+        """
+        Scarica una pagina e ne decodifica il json, riportando agli
+        hook latenza, byte ricevuti e tempo di decodifica.
+
+        :param url: str - url da chiamare
+        :param kind: str - tipo di endpoint ('user', 'tag', 'post', 'profile', 'comments')
+        :param cache_kind: str - tipo di pagina per la cache, None per non usarla
+        :param budget: RetryBudget - budget di ripetizioni della ricerca
+        :return: tuple - risposta e json decodificato (None se non è un json valido)
+        """
+        retries = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                res = self._get(url, cache_kind)
+            except Exception as e:
+                if self.retry.classify(exception=e) != RETRY or not self.retry.allow(retries + 1, budget):
+                    raise
+                retries += 1
+                self._sleep(kind, self.retry.delay(retries))
+                continue
+            latency = time.perf_counter() - start
+            if self.retry.classify(res) != RETRY:
+                break
+            if self.hooks:
+                _notify(self.hooks, RequestEvent(kind, url, res.status_code, latency, len(res.content),
+                                                 retries=retries))
+            if not self.retry.allow(retries + 1, budget):
+                raise PyInstagramException("Troppi tentativi falliti ({}) per l'indirizzo: {}".format(
+                    res.status_code, url))
+            retries += 1
+            self._sleep(kind, self.retry.delay(retries, res.headers.get('Retry-After')))
+        try:
+            data = self.loads(res.content)
+        except Exception:
+            data = None
+        if self.hooks:
+            _notify(self.hooks, RequestEvent(
+                kind, url, res.status_code, latency, len(res.content), time.perf_counter() - start - latency,
+                retries, from_cache=getattr(res, 'from_cache', False)
+            ))
+        return res, data
+
+    def _sleep(self, kind, seconds):
+        """Attende, riportando l'attesa agli hook"""
+        if self.hooks:
+            _notify(self.hooks, RequestEvent(kind, sleep=seconds))
+        time.sleep(seconds)
 
     def get_user_info(self, user):
         """
@@ -180,14 +683,13 @@ class InstagramJsonClient(object):
             base=self.base_url,
             user=user
         )
-        res = self.session.get(base_url)
-        try:
-            res = res.json()
-        except Exception:
+        _, res = self._fetch(base_url, 'profile', 'profile', self.retry.new_budget())
+        if res is None:
             raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(base_url))
         return res.get('user', {})
 
-    def get_by_user(self, user, count=None, since=None, until=None):
+    def get_by_user(self, user, count=None, since=None, until=None, resume=False, sync=False, as_='json',
+                    fields=None, sink=None, seek=False):
         """
         Ricerca post (pubblici) di un utente.
         Gestisce automaticamente la paginazione.
@@ -330,36 +832,98 @@ class InstagramJsonClient(object):
         :param count: int - limita il numero di risultati
         :param since: str - Risultati a partire da questa data, es. "20170101000000"
         :param until: str - Risultati entro questa data, es. "20171231235959"
+        :param resume: bool - riprende la ricerca dall'ultima pagina salvata nei checkpoints
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
+        :param as_: str - formato dei risultati: 'json' (il json originale), 'dict' (solo
+                          i campi estratti), 'orm' (oggetti Media), 'records' (oggetti MediaRecord)
+                          o 'columns' (un unico oggetto MediaColumns, convertibile in array NumPy,
+                          tabella Arrow o DataFrame pandas)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :param sink: DatabaseSink or NDJSONSink - scrive i risultati nel sink invece di
+                     restituirli (ritorna il numero di risultati scritti)
+        :param seek: bool - con until, salta direttamente ai post precedenti a until ricavando
+                            il cursore dalla data (gli id dei media la contengono) invece di
+                            scaricare tutte le pagine più recenti; se Instagram non accetta il
+                            cursore torna alla scansione dall'inizio
         :return:
         """
-        if since:
-            try:
-                since = datetime.strptime(since, "%Y%m%d%H%M%S")
-            except ValueError:
-                raise ValueError("Il parametro since non è in un formato corretto (es. '20170101000000')")
+        if as_ == 'columns':
+            _check_columns(sink, fields)
+            return MediaColumns.collect(self.iter_by_user(user, count, since, until, resume=resume, sync=sync,
+                                                          as_='dict', seek=seek))
+        items = self.iter_by_user(user, count, since, until, resume=resume, sync=sync, as_=as_, fields=fields,
+                                  seek=seek)
+        return sink.write_many(items) if sink is not None else list(items)
 
-        if until:
-            try:
-                until = datetime.strptime(until, "%Y%m%d%H%M%S")
-            except ValueError:
-                raise ValueError("Il parametro until non è in un formato corretto (es. '20170101000000')")
+    def iter_by_user(self, user, count=None, since=None, until=None, resume=False, sync=False, as_='json',
+                     fields=None, seek=False):
+        """
+        Versione "lazy" di get_by_user: restituisce un generatore
+        che produce i post man mano che le pagine vengono scaricate.
+        Interrompere l'iterazione interrompe anche la paginazione.
+
+        :param user: str - username Instagram
+        :param count: int - limita il numero di risultati
+        :param since: str - Risultati a partire da questa data, es. "20170101000000"
+        :param until: str - Risultati entro questa data, es. "20171231235959"
+        :param resume: bool - riprende la ricerca dall'ultima pagina salvata nei checkpoints
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore)
+        :param as_: str - formato dei risultati: 'json' (il json originale), 'dict' (solo
+                          i campi estratti), 'orm' (oggetti Media) o 'records' (oggetti MediaRecord)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :param seek: bool - con until, salta direttamente ai post precedenti a until ricavando
+                            il cursore dalla data (gli id dei media la contengono) invece di
+                            scaricare tutte le pagine più recenti; se Instagram non accetta il
+                            cursore torna alla scansione dall'inizio
+        :return: generator - post dell'utente
+        """
+        budget = self.retry.new_budget()
+        # le date vengono convertite una volta sola, non per ogni post
+        since = _timestamp(_parse_date(since, 'since'))
+        until = _timestamp(_parse_date(until, 'until'))
+        _check_fields(as_, fields)
+        convert = Converter(dict(USER_FIELDS, **(fields or {})), as_, self.raw_json, self.rendition)
+        source = "user:{}".format(user)
+        max_id = self._load_cursor(source, resume)
+        seek_id = _seek_id(until, seek, max_id)
+        seen = _seen_session(self.seen, convert)
+        if sync:
+            media = self._iter_user(user, None, since, until, source, max_id, convert, seek_id, seen, budget)
+            key = _sync_key(convert, itemgetter('id', 'date'))
+            media = _iter_new(media, self.checkpoints, source, key)
+        else:
+            media = self._iter_user(user, count, since, until, source, max_id, convert, seek_id, seen, budget)
+        return take(seen.deliver(media) if seen is not None else media, count)
 
-        all_data = []
+    def _iter_user(self, user, count, since, until, source, max_id, convert, seek_id=None, seen=None,
+                   budget=None):
+        yielded = 0
         base_url = "{base}{user}?__a=1{{max}}".format(
             base=self.base_url,
             user=user
         )
-        max_id = ""
-        next_url = base_url.format(max=max_id)
+        cursor = max_id or seek_id
+        next_url = base_url.format(max="&max_id={}".format(cursor) if cursor else "")
         while True:
-            res = self.session.get(next_url)
-            if not res.status_code == 200:
-                return all_data[:count]
-            try:
-                res = res.json()
-            except Exception:
+            # solo la prima pagina del profilo passa dalla cache
+            response, res = self._fetch(next_url, 'user', None if cursor else 'profile', budget)
+            if seek_id and (response.status_code != 200 or res is None):
+                # Instagram non accetta il cursore ricavato da until: scorro dall'inizio
+                seek_id = cursor = None
+                next_url = base_url.format(max="")
+                continue
+            seek_id = None
+            if not response.status_code == 200:
+                return
+            if res is None:
                 raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(next_url))
 
+            nodes = []
+            finished = False
             for media_res in res['user']['media']['nodes']:
 
                 # Instagram non mi permette di cercare per data, però mi fornisce la
@@ -368,30 +932,37 @@ class InstagramJsonClient(object):
                 # verifico che il mio post sia stato creato in questo lasso di tempo.
 
                 created_at = int(media_res['date'])
-                if since and created_at < time.mktime(since.timetuple()):
+                if since is not None and created_at < since:
                     # sono andato troppo indietro, posso uscire
-                    return all_data[:count]
-                if until and created_at > time.mktime(until.timetuple()):
-                    continue
-                all_data.append(media_res)
-
-            if res['user']['media']['nodes'] and (not len(all_data) > count if count else True):
-                # ho oggetti, ne ho altri da scaricare, e non ho raggiunto il limite di risultati
-                try:
-                    max_id = res['user']['media']['nodes'][-1]['id']
-                    next_url = base_url.format(max="&max_id={}".format(max_id))
-                except IndexError:
-                    # aspetto un po', index è vuoto e Instagram mi blocca il flusso
-                    time.sleep(random.randint(10, 60))
-                else:
-                    # tutto ok, ho altri dati da scaricare
+                    finished = True
+                    break
+                if until is not None and created_at > until:
                     continue
+                nodes.append(media_res)
+
+            for media in _convert_page(convert, nodes, seen):
+                yield media
+                yielded += 1
+                if count and yielded >= count:
+                    # ho raggiunto il limite di risultati
+                    return
+            # i cursori vengono salvati solo quando il chiamante ha letto tutta la pagina
+            if finished:
+                yield Deferred(self._save_cursor, source, None)
+                return
+
+            if res['user']['media']['nodes']:
+                # ho oggetti e ne ho altri da scaricare
+                max_id = cursor = res['user']['media']['nodes'][-1]['id']
+                next_url = base_url.format(max="&max_id={}".format(max_id))
+                yield Deferred(self._save_cursor, source, max_id)
             else:
-                # non ho dati, oppure ne ho di più di quelli voluti
-                break
-        return all_data[:count]
+                # non ho altri dati
+                yield Deferred(self._save_cursor, source, None)
+                return
 
-    def get_by_hashtag(self, tags=(), count=1000000, top_posts=True, since=None, until=None):
+    def get_by_hashtag(self, tags=(), count=1000000, top_posts=True, since=None, until=None, workers=1,
+                       resume=False, sync=False, as_='orm', fields=None, sink=None, seek=False):
         """
         Ricerca per hashtag.
         Gestisce automaticamente la paginazione.
@@ -452,105 +1023,162 @@ class InstagramJsonClient(object):
         :param top_posts: bool - limita ai top posts altrimenti ritorna tutto
         :param since: str - Risultati a partire da questa data, es. "20170101000000"
         :param until: str - Risultati entro questa data, es. "20171231235959"
+        :param workers: int - numero di hashtag scaricati in parallelo
+        :param resume: bool - riprende la ricerca dall'ultima pagina salvata nei checkpoints
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore,
+                            solo con top_posts=False)
+        :param as_: str - formato dei risultati: 'orm' (oggetti Media), 'records' (oggetti
+                          MediaRecord, più leggeri e convertibili con to_orm()), 'dict' (solo
+                          i campi estratti), 'json' (il json originale) o 'columns' (un unico
+                          oggetto MediaColumns, convertibile in array NumPy, tabella Arrow o
+                          DataFrame pandas)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :param sink: DatabaseSink or NDJSONSink - scrive i risultati nel sink invece di
+                     restituirli (ritorna il numero di risultati scritti)
+        :param seek: bool - con until, salta direttamente ai post precedenti a until ricavando
+                            il cursore dalla data (gli id dei media la contengono) invece di
+                            scaricare tutte le pagine più recenti; se Instagram non accetta il
+                            cursore torna alla scansione dall'inizio
+                            (solo con top_posts=False)
         :return: list - lista di dizionari
         """
-        if isinstance(tags, str):
-            tags = (tags, )
+        if as_ == 'columns':
+            _check_columns(sink, fields)
+            return MediaColumns.collect(self.iter_by_hashtag(tags, count, top_posts, since, until, workers=workers,
+                                                             resume=resume, sync=sync, as_='dict', seek=seek))
+        items = self.iter_by_hashtag(tags, count, top_posts, since, until, workers=workers, resume=resume,
+                                     sync=sync, as_=as_, fields=fields, seek=seek)
+        return sink.write_many(items) if sink is not None else list(items)
 
-        if since:
-            try:
-                since = datetime.strptime(since, "%Y%m%d%H%M%S")
-            except ValueError:
-                raise ValueError("Il parametro since non è in un formato corretto (es. '20170101000000')")
+    def iter_by_hashtag(self, tags=(), count=None, top_posts=True, since=None, until=None, workers=1,
+                        resume=False, sync=False, as_='orm', fields=None, seek=False):
+        """
+        Versione "lazy" di get_by_hashtag: restituisce un generatore
+        che produce oggetti Media man mano che le pagine vengono
+        scaricate, un hashtag dopo l'altro. Con workers > 1 gli
+        hashtag vengono scaricati in parallelo e i risultati alternati
+        tra un hashtag e l'altro; raggiunto count, tutti i thread
+        smettono di paginare.
 
-        if until:
-            try:
-                until = datetime.strptime(until, "%Y%m%d%H%M%S")
-            except ValueError:
-                raise ValueError("Il parametro until non è in un formato corretto (es. '20170101000000')")
-
-        mapper = {
-            'id': 'id',
-            'comments': 'edge_media_to_comment.count',
-            'unix_datetime': 'taken_at_timestamp',
-            'user': 'owner.id',
-            'likes': 'edge_liked_by.count',
-            'is_video': 'is_video',
-            'url': 'display_src',
-            'height': 'dimensions.height',
-            'width': 'dimensions.width',
-            'code': 'shortcode'
-        }
-
-        all_data = []
+        :param tags: str or tuple - hashtag (senza il #) o tupla di hastag
+        :param count: int - limita i risultati
+        :param top_posts: bool - limita ai top posts altrimenti ritorna tutto
+        :param since: str - Risultati a partire da questa data, es. "20170101000000"
+        :param until: str - Risultati entro questa data, es. "20171231235959"
+        :param workers: int - numero di hashtag scaricati in parallelo
+        :param resume: bool - riprende la ricerca dall'ultima pagina salvata nei checkpoints
+                              (solo con top_posts=False)
+        :param sync: bool - restituisce solo i post successivi all'ultimo visto
+                            nella ricerca precedente (serve un CheckpointStore,
+                            solo con top_posts=False: i top post non sono in
+                            ordine di data)
+        :param as_: str - formato dei risultati: 'orm' (oggetti Media), 'records' (oggetti
+                          MediaRecord, più leggeri e convertibili con to_orm()), 'dict' (solo
+                          i campi estratti) o 'json' (il json originale)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :param seek: bool - con until, salta direttamente ai post precedenti a until ricavando
+                            il cursore dalla data (gli id dei media la contengono) invece di
+                            scaricare tutte le pagine più recenti; se Instagram non accetta il
+                            cursore torna alla scansione dall'inizio
+                            (solo con top_posts=False)
+        :return: generator - oggetti Media
+        """
+        if sync and top_posts:
+            # i top post non sono in ordine di data: fermarsi al primo post già visto
+            # farebbe perdere i post recenti più nuovi
+            raise ValueError("Il parametro sync si può usare solo con top_posts=False")
+        budget = self.retry.new_budget()
+        if isinstance(tags, str):
+            tags = (tags, )
+        _check_fields(as_, fields)
+        convert = Converter(dict(HASHTAG_FIELDS, **(fields or {})), as_, self.raw_json, self.rendition)
+        # le date vengono convertite una volta sola, non per ogni post
+        since = _timestamp(_parse_date(since, 'since'))
+        until = _timestamp(_parse_date(until, 'until'))
+        seen = _seen_session(self.seen, convert)
+        streams = []
         for tag in tags:
-            all_data_tag = []
-            base_url = "{base}explore/tags/{tag}?__a=1{{max}}".format(
-                base=self.base_url,
-                tag=tag
-            )
-            max_id = ""
-            next_url = base_url.format(max=max_id)
-            while True:
-                res = self.session.get(next_url)
-                try:
-                    res = res.json()
-                except Exception:
-                    if "Sorry, this page isn't available" in res.text:
-                        # Post rimosso o non più raggiungibile
-                        continue
-                    else:
-                        raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(next_url))
-                res_media = res['graphql']['hashtag']['edge_hashtag_to_top_posts'] if top_posts else res['graphql']['hashtag']['edge_hashtag_to_media']
-                has_next_page = res['graphql']['hashtag']['edge_hashtag_to_media']['page_info']['has_next_page']
-
-                # converto in oggetti SqlAlchemy
-                sqlalchemy_media = []
-                for element in res_media['edges']:
-
-                    # Instagram non mi permette di cercare per data, però mi fornisce la
-                    # data di creazione del post in formato Unix Timestamp. Quindi, per
-                    # gestire il caso in cui volessi solo risultati in un certo intervallo,
-                    # verifico che il mio post sia stato creato in questo lasso di tempo.
-
-                    created_at = int(element['node']['taken_at_timestamp'])
-                    if since and created_at < time.mktime(since.timetuple()):
-                        # sono andato troppo indietro, posso uscire
-                        break
-                    if until and created_at > time.mktime(until.timetuple()):
-                        continue
-
-                    model = Media()
-                    for field_to, getter in mapper.items():
-                        path = getter.split('.')
-                        val = element['node']
-                        for key in path:
-                            val = val.get(key, {})
-                        if isinstance(val, dict):
-                            val = None
-                        setattr(model, field_to, val)
-                    model.json = element['node']
-                    model.caption = element['node']['edge_media_to_caption']['edges'][0]['node']['text']
-                    sqlalchemy_media.append(model)
-                all_data_tag.extend(sqlalchemy_media)
-
-                if res_media['edges'] and has_next_page and not len(all_data_tag) > count and not top_posts:
-                    try:
-                        max_id = res['graphql']['hashtag']['edge_hashtag_to_media']['page_info']['end_cursor']
-                        next_url = base_url.format(max="&max_id={}".format(max_id))
-                    except IndexError:
-                        # aspetto un po', index è vuoto e Instagram mi blocca il flusso
-                        time.sleep(random.randint(10, 60))
-                    else:
-                        # tutto ok, ho altri dati da scaricare
-                        continue
+            source = "tag:{}".format(tag)
+            max_id = "" if top_posts else self._load_cursor(source, resume)
+            # i top post non sono paginati
+            seek_id = _seek_id(until, seek and not top_posts, max_id)
+            stream = self._iter_tag(tag, top_posts, since, until, source, max_id, convert, seek_id, seen, budget)
+            if sync:
+                key = _sync_key(convert, itemgetter('id', 'taken_at_timestamp'))
+                stream = _iter_new(stream, self.checkpoints, source, key)
+            streams.append(stream)
+        # cursori, limiti della sincronizzazione e post visti vengono aggiornati
+        # dal lato del chiamante, solo per i post effettivamente restituiti
+        media = iter_parallel(streams, workers) if workers > 1 else chain.from_iterable(streams)
+        return take(seen.deliver(media) if seen is not None else media, count)
+
+    def _iter_tag(self, tag, top_posts, since, until, source, max_id, convert, seek_id=None, seen=None,
+                  budget=None):
+        base_url = "{base}explore/tags/{tag}?__a=1{{max}}".format(
+            base=self.base_url,
+            tag=tag
+        )
+        cursor = max_id or seek_id
+        next_url = base_url.format(max="&max_id={}".format(cursor) if cursor else "")
+        while True:
+            response, res = self._fetch(next_url, 'tag', None if cursor else 'tag', budget)
+            if res is None:
+                if NOT_AVAILABLE in response.text:
+                    # hashtag non più raggiungibile: ripetere la richiesta non serve
+                    return
+                elif seek_id:
+                    # Instagram non accetta il cursore ricavato da until: scorro dall'inizio
+                    seek_id = cursor = None
+                    next_url = base_url.format(max="")
+                    continue
                 else:
-                    # non ho dati, oppure ne ho di più di quelli voluti
+                    raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(next_url))
+            seek_id = None
+            res_media = res['graphql']['hashtag']['edge_hashtag_to_top_posts'] if top_posts else res['graphql']['hashtag']['edge_hashtag_to_media']
+            has_next_page = res['graphql']['hashtag']['edge_hashtag_to_media']['page_info']['has_next_page']
+
+            nodes = []
+            finished = False
+            for element in res_media['edges']:
+
+                # Instagram non mi permette di cercare per data, però mi fornisce la
+                # data di creazione del post in formato Unix Timestamp. Quindi, per
+                # gestire il caso in cui volessi solo risultati in un certo intervallo,
+                # verifico che il mio post sia stato creato in questo lasso di tempo.
+
+                created_at = int(element['node']['taken_at_timestamp'])
+                if since is not None and created_at < since:
+                    # sono andato troppo indietro, posso uscire
+                    finished = True
                     break
-            all_data.extend(all_data_tag)
-        return all_data[:count]
+                if until is not None and created_at > until:
+                    continue
+                nodes.append(element['node'])
+
+            # converto tutta la pagina nel formato richiesto (di default oggetti SqlAlchemy)
+            for media in _convert_page(convert, nodes, seen):
+                yield media
+            # i cursori vengono salvati solo quando il chiamante ha letto tutta la pagina
+            if finished:
+                if not top_posts:
+                    yield Deferred(self._save_cursor, source, None)
+                return
 
-    def get_by_media_codes(self, codes=(), all_comments=False):
+            max_id = res['graphql']['hashtag']['edge_hashtag_to_media']['page_info'].get('end_cursor')
+            if res_media['edges'] and has_next_page and max_id and not top_posts:
+                cursor = max_id
+                next_url = base_url.format(max="&max_id={}".format(max_id))
+                yield Deferred(self._save_cursor, source, max_id)
+            else:
+                # non ho altri dati da scaricare
+                if not top_posts:
+                    yield Deferred(self._save_cursor, source, None)
+                return
+
+    def get_by_media_codes(self, codes=(), all_comments=False, as_='json', fields=None, sink=None):
         """
         Restituisce una lista contenente i dati dei post richiesti
         (identificati dalla stringa 'code' del post). Attivando
@@ -562,41 +1190,170 @@ class InstagramJsonClient(object):
 
         :param codes: stringa del codice o tupla con i codici dei post
         :param all_comments: bool - se attivato, scarica tutti i commenti
+        :param as_: str - formato dei risultati: 'json' (il json completo della pagina), 'dict'
+                          (solo i campi estratti), 'orm' (oggetti Media) o 'records' (oggetti MediaRecord)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :param sink: DatabaseSink or NDJSONSink - scrive i risultati nel sink invece di
+                     restituirli (ritorna il numero di risultati scritti)
         :return: lista di json con i dati dei post richiesti
         """
+        items = self.iter_by_media_codes(codes, all_comments, as_=as_, fields=fields)
+        return sink.write_many(items) if sink is not None else list(items)
+
+    def iter_by_media_codes(self, codes=(), all_comments=False, as_='json', fields=None):
+        """
+        Versione "lazy" di get_by_media_codes: restituisce un
+        generatore che produce i dati di un post alla volta.
+
+        :param codes: stringa del codice o tupla con i codici dei post
+        :param all_comments: bool - se attivato, scarica tutti i commenti
+        :param as_: str - formato dei risultati: 'json' (il json completo della pagina), 'dict'
+                          (solo i campi estratti), 'orm' (oggetti Media) o 'records' (oggetti MediaRecord)
+        :param fields: dict - campi aggiuntivi da estrarre, nel formato {campo: 'percorso.nel.json'}
+                               (solo con as_='dict')
+        :return: generator - json con i dati dei post richiesti
+        """
         if isinstance(codes, str):
             codes = (codes,)
+        _check_fields(as_, fields)
+        convert = Converter(dict(POST_FIELDS, **(fields or {})), as_, self.raw_json, self.rendition)
+        return self._iter_media_codes(codes, all_comments, convert, self.retry.new_budget())
 
-        all_data = []
-
+    def _iter_media_codes(self, codes, all_comments, convert, budget=None):
         for code in codes:
-            url = "{base}p/{code}?__a=1".format(
-                base=self.base_url,
-                code=code
-            )
-            res = self.session.get(url)
-            try:
-                res = res.json()
-            except Exception:
-                if "Sorry, this page isn't available" in res.text:
-                    # Post rimosso o non più raggiungibile
-                    continue
-                else:
-                    raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(url))
-
+            url, res = self._get_post(code, budget)
+            if res is None:
+                # Post rimosso o non più raggiungibile
+                continue
             if all_comments:
-                while True:
-                    page_info = res['graphql']['shortcode_media']['edge_media_to_comment']['page_info']
-                    if page_info['has_next_page']:
-                        next_url = url + "&max_id={}".format(page_info['end_cursor'])
-                        next_res = self.session.get(next_url)
-                        next_res = next_res.json()
-                        res_edges = res['graphql']['shortcode_media']['edge_media_to_comment']['edges']
-                        next_edges = next_res['graphql']['shortcode_media']['edge_media_to_comment']['edges']
-                        res_edges.extend(next_edges)
-                    else:
-                        break
-            all_data.append(res)
-        return all_data
+                res_edges = res['graphql']['shortcode_media']['edge_media_to_comment']['edges']
+                for edges in self._iter_comment_pages(url, res, budget):
+                    res_edges.extend(edges)
+            if convert.as_ == 'json':
+                yield res
+            else:
+                yield convert(res['graphql']['shortcode_media'])
+
+    def iter_comments(self, code):
+        """
+        Restituisce un generatore sui commenti di un post, gestendo
+        la paginazione: ogni pagina viene scaricata solo quando
+        quella precedente è stata consumata.
+
+        :param code: str - codice del post
+        :return: generator - dizionari con i dati dei commenti
+        """
+        budget = self.retry.new_budget()
+        url, res = self._get_post(code, budget)
+        if res is None:
+            return
+        for edge in res['graphql']['shortcode_media']['edge_media_to_comment']['edges']:
+            yield edge['node']
+        for edges in self._iter_comment_pages(url, res, budget):
+            for edge in edges:
+                yield edge['node']
+
+    def get_comments_by_media_codes(self, codes=(), count=None, since=None, workers=1, as_='orm', sink=None):
+        """
+        Scarica i commenti di più post. A differenza di
+        get_by_media_codes con all_comments=True, i commenti non
+        vengono accumulati nel json del post ma restituiti (o scritti
+        nel sink) una pagina alla volta.
+
+        :param codes: stringa del codice o tupla con i codici dei post
+        :param count: int - numero massimo di commenti per ogni post
+        :param since: str - solo i commenti a partire da questa data, es. "20170101000000"
+        :param workers: int - numero di post scaricati in parallelo
+        :param as_: str - formato dei risultati: 'orm' (oggetti Comment), 'records' (oggetti
+                          CommentRecord), 'dict' (solo i campi estratti) o 'json' (il json originale)
+        :param sink: DatabaseSink or NDJSONSink - scrive i risultati nel sink invece di
+                     restituirli (ritorna il numero di risultati scritti)
+        :return: list - commenti dei post richiesti
+        """
+        items = self.iter_comments_by_media_codes(codes, count, since, workers, as_)
+        return sink.write_many(items) if sink is not None else list(items)
+
+    def iter_comments_by_media_codes(self, codes=(), count=None, since=None, workers=1, as_='orm'):
+        """
+        Versione "lazy" di get_comments_by_media_codes. Con workers > 1
+        i post vengono scaricati in parallelo e i commenti alternati
+        tra un post e l'altro, così che un post con moltissimi commenti
+        non blocchi gli altri.
+
+        :param codes: stringa del codice o tupla con i codici dei post
+        :param count: int - numero massimo di commenti per ogni post
+        :param since: str - solo i commenti a partire da questa data, es. "20170101000000"
+        :param workers: int - numero di post scaricati in parallelo
+        :param as_: str - formato dei risultati: 'orm', 'records', 'dict' o 'json'
+        :return: generator - commenti dei post richiesti
+        """
+        budget = self.retry.new_budget()
+        if isinstance(codes, str):
+            codes = (codes,)
+        convert = CommentConverter(as_, self.raw_json)
+        since = _timestamp(_parse_date(since, 'since'))
+        streams = [take(self._iter_post_comments(code, since, convert, budget), count) for code in codes]
+        if workers > 1:
+            return iter_parallel(streams, workers)
+        return chain.from_iterable(streams)
+
+    def _iter_post_comments(self, code, since, convert, budget=None):
+        url, res = self._get_post(code, budget)
+        if res is None:
+            return
+        media = res['graphql']['shortcode_media']
+        first_page = media['edge_media_to_comment']['edges']
+        for edges in chain((first_page, ), self._iter_comment_pages(url, res, budget)):
+            nodes = [edge['node'] for edge in edges]
+            finished = False
+            if since is not None:
+                recent = [node for node in nodes if node['created_at'] >= since]
+                # posso smettere di paginare solo se la pagina va dal commento più
+                # recente al più vecchio (le successive saranno ancora più vecchie);
+                # altrimenti filtro ogni pagina
+                newest_first = len(nodes) > 1 and nodes[0]['created_at'] > nodes[-1]['created_at']
+                finished = newest_first and len(recent) < len(nodes)
+                nodes = recent
+            for item in convert.convert_comments(media, nodes):
+                yield item
+            if finished:
+                return
+
+    def _get_post(self, code, budget=None):
+        """
+        Scarica la pagina di un post.
 
+        :param code: str - codice del post
+        :param budget: RetryBudget - budget di ripetizioni della ricerca
+        :return: tuple - url e json del post (None se il post non è più raggiungibile)
+        """
+        url = "{base}p/{code}?__a=1".format(
+            base=self.base_url,
+            code=code
+        )
+        res, data = self._fetch(url, 'post', 'post', budget)
+        if data is not None:
+            return url, data
+        if NOT_AVAILABLE in res.text:
+            return url, None
+        raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(url))
 
+    def _iter_comment_pages(self, url, res, budget=None):
+        """
+        Generatore sulle pagine di commenti successive alla prima.
+
+        :param url: str - url del post
+        :param res: dict - json della prima pagina del post
+        :param budget: RetryBudget - budget di ripetizioni della ricerca
+        :return: generator - liste di commenti
+        """
+        page_info = res['graphql']['shortcode_media']['edge_media_to_comment']['page_info']
+        while page_info['has_next_page']:
+            next_url = url + "&max_id={}".format(page_info['end_cursor'])
+            _, next_res = self._fetch(next_url, 'comments', budget=budget)
+            if next_res is None:
+                raise PyInstagramException("Impossibile scaricare i dati dall'indirizzo: {}".format(next_url))
+            comments = next_res['graphql']['shortcode_media']['edge_media_to_comment']
+            yield comments['edges']
+            page_info = comments['page_info']
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Cache persistente (SQLite) delle risposte di InstagramJsonClient.
+
+Le pagine ?__a=1 di profili, post e hashtag vengono salvate su
+disco insieme a una scadenza che dipende dal tipo di pagina; quando
+la cache supera la dimensione massima vengono eliminate le pagine
+usate meno di recente (LRU).
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class CachedResponse(object):
+    """
+    Risposta servita dalla cache: espone la stessa interfaccia
+    minima di requests.Response usata dai client.
+    """
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache(object):
+    """
+    Cache delle risposte indicizzata per url.
+
+    Esempio:
+
+     >>> cache = ResponseCache("instagram.db", ttl={'post': 7 * 24 * 3600})
+     >>> app = InstagramJsonClient(cache=cache)
+     >>> app.get_by_media_codes(codes)
+     >>> cache.stats()
+    """
+
+    # durata (in secondi) delle pagine in cache per tipo di endpoint
+    TTL = {
+        'profile': 60 * 60,
+        'post': 24 * 60 * 60,
+        'tag': 10 * 60,
+    }
+
+    def __init__(self, path=":memory:", ttl=None, max_size=256 * 1024 * 1024):
+        """
+        :param path: str - file SQLite in cui salvare la cache
+        :param ttl: dict - durata in secondi per tipo di pagina ('profile', 'post', 'tag'),
+                           sovrascrive i valori di default
+        :param max_size: int - dimensione massima in byte delle risposte salvate
+        """
+        self.ttl = dict(self.TTL, **(ttl or {}))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, kind TEXT, body BLOB, size INTEGER, expires REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url):
+        """
+        :param url: str - url della pagina
+        :return: bytes - contenuto della pagina, None se assente o scaduta
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, size, expires FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None or row[2] < now:
+                self.misses += 1
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                    self._size -= row[1]
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET accessed = ? WHERE url = ?", (now, url))
+            return bytes(row[0])
+
+    def set(self, url, kind, content):
+        """
+        Salva una pagina in cache (solo se per il suo tipo è prevista una durata).
+
+        :param url: str - url della pagina
+        :param kind: str - tipo di pagina ('profile', 'post', 'tag')
+        :param content: bytes - contenuto della pagina
+        :return: None
+        """
+        ttl = self.ttl.get(kind)
+        if not ttl or len(content) > self.max_size:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, kind, body, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, kind, sqlite3.Binary(content), len(content), now + ttl, now)
+            )
+            self._size += len(content) - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        """Elimina le pagine usate meno di recente finché la cache non rientra nei limiti"""
+        while self._size > self.max_size:
+            rows = self._db.execute("SELECT url, size FROM responses ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for url, size in rows:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._size -= size
+                if self._size <= self.max_size:
+                    return
+
+    def stats(self):
+        """
+        :return: dict - hit, miss, numero di pagine e dimensione della cache
+        """
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'size': self._size,
+        }
+
+    def clear(self):
+        """Svuota la cache"""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._size = 0
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Salvataggio dello stato delle ricerche: i cursori di paginazione,
+per poter riprendere una ricerca interrotta dall'ultima pagina
+scaricata invece che dalla prima, e il media più recente visto per
+ogni sorgente, per scaricare solo le novità (sincronizzazione
+incrementale).
+"""
+import sqlite3
+import threading
+import time
+
+
+class CheckpointStore(object):
+    """
+    Archivio SQLite dei cursori di paginazione e dei media più
+    recenti, indicizzati per sorgente (es. "user:nasa" o "tag:mfw").
+
+    Esempio:
+
+     >>> app = InstagramJsonClient(checkpoints=CheckpointStore("crawl.db"))
+     >>> for media in app.iter_by_hashtag("mfw", top_posts=False, resume=True):
+     >>>     ...
+    """
+    def __init__(self, path=":memory:"):
+        """
+        :param path: str - file SQLite in cui salvare i cursori
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cursors (source TEXT PRIMARY KEY, cursor TEXT, updated REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS marks (source TEXT PRIMARY KEY, media_id TEXT, timestamp INTEGER, updated REAL)"
+        )
+
+    def get_cursor(self, source):
+        """
+        :param source: str - sorgente della ricerca
+        :return: str - ultimo cursore salvato, None se assente
+        """
+        with self._lock:
+            row = self._db.execute("SELECT cursor FROM cursors WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, source, cursor):
+        """
+        Salva il cursore della prossima pagina da scaricare.
+
+        :param source: str - sorgente della ricerca
+        :param cursor: str - cursore (max_id o end_cursor)
+        :return: None
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cursors (source, cursor, updated) VALUES (?, ?, ?)",
+                (source, str(cursor), time.time())
+            )
+
+    def clear_cursor(self, source):
+        """
+        Cancella il cursore di una ricerca terminata.
+
+        :param source: str - sorgente della ricerca
+        :return: None
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM cursors WHERE source = ?", (source,))
+
+    def get_mark(self, source):
+        """
+        :param source: str - sorgente della ricerca
+        :return: tuple - id e timestamp del media più recente visto, None se assente
+        """
+        with self._lock:
+            row = self._db.execute("SELECT media_id, timestamp FROM marks WHERE source = ?", (source,)).fetchone()
+        return tuple(row) if row else None
+
+    def set_mark(self, source, media_id, timestamp):
+        """
+        Salva il media più recente visto per una sorgente.
+
+        :param source: str - sorgente della ricerca
+        :param media_id: str - id del media
+        :param timestamp: int - data di creazione del media (Unix Timestamp)
+        :return: None
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO marks (source, media_id, timestamp, updated) VALUES (?, ?, ?, ?)",
+                (source, str(media_id), int(timestamp), time.time())
+            )
+
+    def close(self):
+        self._db.close()
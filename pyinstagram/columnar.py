@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Risultati in formato colonnare, per l'analisi dei dati (likes,
+commenti, date) con NumPy, Arrow o pandas.
+
+Le colonne numeriche sono array tipizzati (modulo array), riempiti
+man mano che le pagine vengono scaricate: non serve tenere in
+memoria né i json dei post né una lista di oggetti Media.
+NumPy, pyarrow e pandas sono dipendenze opzionali.
+"""
+import importlib
+from array import array
+
+from .exceptions import PyInstagramException
+
+# nome della colonna, campo estratto da cui leggerla, typecode (None = stringa)
+COLUMNS = (
+    ('id', 'id', 'q'),
+    ('code', 'code', None),
+    ('owner', 'user', 'q'),
+    ('likes', 'likes', 'q'),
+    ('comments', 'comments', 'q'),
+    ('timestamp', 'unix_datetime', 'q'),
+    ('is_video', 'is_video', 'b'),
+    ('width', 'width', 'i'),
+    ('height', 'height', 'i'),
+)
+
+# valore usato nelle colonne numeriche quando il dato manca
+MISSING = -1
+
+
+def _require(module, extra):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise PyInstagramException(
+            "Per usare questa funzione installa {0} (pip install pyinstagram[{1}])".format(module, extra)
+        )
+
+
+def _to_int(value):
+    if value is None:
+        return MISSING
+    if isinstance(value, str):
+        # gli id dell'API ufficiale sono nel formato <media>_<utente>
+        value = value.split('_', 1)[0]
+    return int(value)
+
+
+class MediaColumns(object):
+    """
+    Contenitore colonnare dei media scaricati.
+
+    Esempio:
+
+     >>> columns = app.get_by_hashtag("mfw", top_posts=False, as_='columns')
+     >>> df = columns.to_pandas()
+     >>> df.groupby(df.timestamp.dt.hour).likes.mean()
+    """
+    def __init__(self):
+        self.columns = {
+            name: array(typecode) if typecode else []
+            for name, _, typecode in COLUMNS
+        }
+
+    @classmethod
+    def collect(cls, rows):
+        """
+        :param rows: iterable - dizionari con i campi estratti (formato 'dict' dei client)
+        :return: MediaColumns
+        """
+        columns = cls()
+        columns.extend(rows)
+        return columns
+
+    def append(self, row):
+        """
+        :param row: dict - campi estratti di un media
+        :return: None
+        """
+        for name, field, typecode in COLUMNS:
+            value = row.get(field)
+            if typecode is None:
+                self.columns[name].append(value)
+            elif typecode == 'b':
+                self.columns[name].append(MISSING if value is None else int(bool(value)))
+            else:
+                self.columns[name].append(_to_int(value))
+
+    def extend(self, rows):
+        """
+        :param rows: iterable - campi estratti di più media (es. una pagina)
+        :return: None
+        """
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.columns['code'])
+
+    def to_numpy(self):
+        """
+        :return: numpy.ndarray - array strutturato con una colonna per campo
+        """
+        np = _require('numpy', 'numpy')
+        dtype = [
+            (name, 'O' if typecode is None else {'q': 'i8', 'i': 'i4', 'b': 'i1'}[typecode])
+            for name, _, typecode in COLUMNS
+        ]
+        result = np.empty(len(self), dtype=dtype)
+        for name, _, _ in COLUMNS:
+            result[name] = self.columns[name]
+        return result
+
+    def to_arrow(self):
+        """
+        :return: pyarrow.Table - tabella Arrow (i valori mancanti sono null)
+        """
+        pa = _require('pyarrow', 'arrow')
+        types = {'q': pa.int64(), 'i': pa.int32(), 'b': pa.bool_()}
+        arrays = []
+        for name, _, typecode in COLUMNS:
+            column = self.columns[name]
+            if typecode is None:
+                arrays.append(pa.array(column, type=pa.string()))
+            else:
+                cast = bool if typecode == 'b' else int
+                values = [None if value == MISSING else cast(value) for value in column]
+                arrays.append(pa.array(values, type=types[typecode]))
+        table = pa.Table.from_arrays(arrays, names=[name for name, _, _ in COLUMNS])
+        return table.set_column(
+            table.schema.get_field_index('timestamp'), 'timestamp',
+            table.column('timestamp').cast(pa.timestamp('s'))
+        )
+
+    def to_pandas(self):
+        """
+        :return: pandas.DataFrame - una riga per media, timestamp convertito in datetime; i valori
+                                    mancanti sono NaT o NA (colonne di tipo Int64, Int32 e boolean)
+        """
+        pd = _require('pandas', 'pandas')
+        np = _require('numpy', 'numpy')
+        data = {}
+        for name, _, typecode in COLUMNS:
+            column = self.columns[name]
+            if typecode is None:
+                data[name] = pd.Series(column, dtype=object)
+                continue
+            values = np.array(column, dtype={'q': 'i8', 'i': 'i4', 'b': 'i1'}[typecode])
+            missing = values == MISSING
+            if name == 'timestamp':
+                data[name] = pd.Series(pd.to_datetime(values, unit='s')).mask(missing)
+            elif typecode == 'b':
+                data[name] = pd.arrays.BooleanArray(values.astype(bool), missing)
+            else:
+                data[name] = pd.arrays.IntegerArray(values, missing)
+        return pd.DataFrame(data)
@@ -2,3 +2,6 @@
 
 __api_version__ = "v1"
 API_URL = "https://api.instagram.com/{}/".format(__api_version__)
+
+# gli id dei media contengono, nei bit più alti, i millisecondi trascorsi da questa data
+INSTAGRAM_EPOCH = 1314220021721
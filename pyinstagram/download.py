@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Download delle immagini e dei video dei media.
+
+I file vengono salvati con il nome dato dall'hash del contenuto
+(es. ab/abcdef....jpg), così la stessa immagine trovata sotto più
+hashtag viene salvata una volta sola. I download interrotti restano
+in una cartella .partial e vengono ripresi con una richiesta Range.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .exceptions import PyInstagramException
+from .extract import RenditionPolicy
+from .transport import Transport
+
+# senza una regola viene scaricata la risoluzione più alta
+_FULL_SIZE = RenditionPolicy()
+
+
+def media_urls(item, videos=True, rendition=None):
+    """
+    :param item: dict, Media o MediaRecord - media restituito dai client
+    :param videos: bool - include anche l'url del video, se presente
+    :param rendition: RenditionPolicy - regola per scegliere la risoluzione
+                                        (per l'immagine solo con i json, negli
+                                        altri casi l'url è già stato scelto dal client)
+    :return: list - url dei file del media
+    """
+    if not isinstance(item, dict):
+        urls = [item.url] if item.url else []
+        if videos and item.is_video:
+            # Media e MediaRecord hanno solo l'url dell'immagine: il video è nel json del post
+            data = item.data
+            video = (rendition or _FULL_SIZE).video_url(data) if data else None
+            if video:
+                urls.append(video)
+        return urls
+    urls = []
+    # formato 'dict' dei client, json delle pagine e json dell'API ufficiale
+    image = item.get('url')
+    if image is None:
+        image = (rendition or _FULL_SIZE).image_url(item)
+    if image:
+        urls.append(image)
+    if videos:
+        video = (rendition or _FULL_SIZE).video_url(item)
+        if video:
+            urls.append(video)
+    return urls
+
+
+class MediaDownloader(object):
+    """
+    Scarica in parallelo i file dei media, scrivendoli su disco a
+    blocchi man mano che arrivano.
+
+    Esempio:
+
+     >>> with MediaDownloader("media") as downloader:
+     >>>     paths = downloader.download_many(app.iter_by_hashtag("mfw", as_='records'))
+     >>> downloader.errors
+    """
+    def __init__(self, directory, transport=None, workers=8, chunk_size=64 * 1024, algorithm='sha256',
+                 videos=True, rendition=None):
+        """
+        :param directory: str - cartella in cui salvare i file
+        :param transport: Transport - trasporto HTTP da usare
+        :param workers: int - numero di download in parallelo
+        :param chunk_size: int - dimensione dei blocchi letti dalla rete e scritti su disco
+        :param algorithm: str - algoritmo di hash (vedi hashlib) usato per il nome dei file
+        :param videos: bool - scarica anche i video
+        :param rendition: RenditionPolicy - risoluzione da scaricare quando si passano i json dei post
+        """
+        self.directory = directory
+        self.partial_directory = os.path.join(directory, '.partial')
+        os.makedirs(self.partial_directory, exist_ok=True)
+        self.transport = transport or Transport(pool_maxsize=workers)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.videos = videos
+        self.rendition = rendition
+        self.downloaded = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, digest TEXT, path TEXT, size INTEGER, updated REAL)"
+        )
+
+    @staticmethod
+    def _key(url):
+        # gli url della CDN cambiano host e firma (querystring) ma non il percorso
+        return urlparse(url).path
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT path FROM files WHERE key = ?", (key,)).fetchone()
+        if row and os.path.exists(os.path.join(self.directory, row[0])):
+            return row[0]
+        return None
+
+    def _store(self, url, partial, digest):
+        """
+        Sposta il file scaricato nella sua posizione definitiva
+        (se non esiste già un file con lo stesso contenuto).
+        """
+        extension = os.path.splitext(urlparse(url).path)[1]
+        path = os.path.join(digest[:2], digest + extension)
+        target = os.path.join(self.directory, path)
+        size = os.path.getsize(partial)
+        if os.path.exists(target):
+            os.remove(partial)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(partial, target)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (key, digest, path, size, updated) VALUES (?, ?, ?, ?, ?)",
+                (self._key(url), digest, path, size, time.time())
+            )
+        return path
+
+    def download(self, url):
+        """
+        Scarica un file, riprendendo il download se ne esiste una
+        parte già scaricata.
+
+        :param url: str - url del file
+        :return: str - percorso del file, relativo a directory
+        """
+        key = self._key(url)
+        path = self._lookup(key)
+        if path is not None:
+            with self._lock:
+                self.skipped += 1
+            return path
+        partial = os.path.join(self.partial_directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        hasher = hashlib.new(self.algorithm)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        with self.transport.request('get', url, headers=headers, stream=True) as response:
+            if response.status_code == 416 and offset:
+                # la parte scaricata era già il file completo
+                mode = None
+            elif response.status_code == 206 and offset:
+                mode = 'ab'
+            elif response.status_code == 200:
+                mode = 'wb'
+            else:
+                raise PyInstagramException("Download fallito ({0}): {1}".format(response.status_code, url))
+            if mode != 'wb':
+                # l'hash deve comprendere anche la parte già scaricata
+                with open(partial, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        hasher.update(chunk)
+            received = 0
+            if mode is not None:
+                with open(partial, mode) as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        received += len(chunk)
+        path = self._store(url, partial, hasher.hexdigest())
+        with self._lock:
+            self.downloaded += 1
+            self.bytes += received
+        return path
+
+    def _safe_download(self, url):
+        try:
+            return self.download(url)
+        except Exception as e:
+            with self._lock:
+                self.errors[url] = e
+            return None
+
+    def download_many(self, items):
+        """
+        Scarica i file di più media in parallelo. Gli errori non
+        interrompono gli altri download e vengono salvati in errors.
+
+        I download partono man mano che i media arrivano (ad esempio
+        da un iter_by_hashtag), senza aspettare la fine della ricerca:
+        al massimo 2 * workers download restano in attesa, poi la
+        lettura dei media si ferma finché non se ne libera uno.
+
+        :param items: iterable - media restituiti dai client (o url)
+        :return: dict - url -> percorso del file, relativo a directory
+        """
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        keys = set()
+        paths = {}
+
+        def download(url):
+            try:
+                path = self._safe_download(url)
+                if path is not None:
+                    with self._lock:
+                        paths[url] = path
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for item in items:
+                for url in ([item] if isinstance(item, str) else media_urls(item, self.videos, self.rendition)):
+                    # un solo download per file, anche se arriva da host o firme diverse
+                    key = self._key(url)
+                    if key in keys:
+                        continue
+                    keys.add(key)
+                    slots.acquire()
+                    pool.submit(download, url)
+        return paths
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
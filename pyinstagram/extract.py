@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Estrazione dei campi dai json restituiti da Instagram.
+
+Ogni campo è descritto da un percorso puntato nel json del post
+(es. 'owner.id' o 'edge_media_to_caption.edges.0.node.text'); i
+percorsi vengono scomposti una volta sola, alla creazione
+dell'estrattore, e poi applicati a tutti i post di una pagina.
+"""
+from . import jsonlib
+from .model import Comment, CommentRecord, Media, MediaRecord
+
+# campi dei nodi delle pagine degli hashtag (explore/tags/<tag>)
+HASHTAG_FIELDS = {
+    'id': 'id',
+    'comments': 'edge_media_to_comment.count',
+    'unix_datetime': 'taken_at_timestamp',
+    'user': 'owner.id',
+    'likes': 'edge_liked_by.count',
+    'is_video': 'is_video',
+    'url': 'display_src',
+    'height': 'dimensions.height',
+    'width': 'dimensions.width',
+    'code': 'shortcode',
+    'caption': 'edge_media_to_caption.edges.0.node.text',
+}
+
+# campi dei nodi della pagina di un utente (<user>?__a=1)
+USER_FIELDS = {
+    'id': 'id',
+    'comments': 'comments.count',
+    'unix_datetime': 'date',
+    'user': 'owner.id',
+    'likes': 'likes.count',
+    'is_video': 'is_video',
+    'url': 'display_src',
+    'height': 'dimensions.height',
+    'width': 'dimensions.width',
+    'code': 'code',
+    'caption': 'caption',
+}
+
+# campi della pagina di un post (p/<code>?__a=1, chiave graphql.shortcode_media)
+POST_FIELDS = {
+    'id': 'id',
+    'comments': 'edge_media_to_comment.count',
+    'unix_datetime': 'taken_at_timestamp',
+    'user': 'owner.id',
+    'likes': 'edge_media_preview_like.count',
+    'is_video': 'is_video',
+    'url': 'display_url',
+    'height': 'dimensions.height',
+    'width': 'dimensions.width',
+    'code': 'shortcode',
+    'caption': 'edge_media_to_caption.edges.0.node.text',
+}
+
+# campi dei commenti (edge_media_to_comment.edges.N.node); id e code
+# del post vengono aggiunti da CommentConverter
+COMMENT_FIELDS = {
+    'id_commento': 'id',
+    'username': 'owner.username',
+    'text': 'text',
+    'unix_datetime': 'created_at',
+}
+
+# formati di output supportati dai metodi dei client
+OUTPUTS = ('json', 'dict', 'orm', 'records')
+
+
+class RenditionPolicy(object):
+    """
+    Sceglie, tra le varie risoluzioni (rendition) di un'immagine o
+    di un video, quella da usare come url del media:
+
+      - min_width: la più piccola larga almeno min_width pixel
+      - width: quella con la larghezza più vicina a width
+      - nessuno dei due: la più grande (il comportamento di default)
+
+    Se nessuna rendition è larga almeno min_width viene scelta la
+    più grande.
+
+    Esempio:
+
+     >>> app = InstagramJsonClient(rendition=RenditionPolicy(min_width=320))
+     >>> app.get_by_hashtag("mfw", as_='records')  # url -> thumbnail 320x320
+    """
+    def __init__(self, width=None, min_width=None):
+        """
+        :param width: int - larghezza desiderata in pixel
+        :param min_width: int - larghezza minima in pixel
+        """
+        if width is not None and min_width is not None:
+            raise ValueError("Specificare solo uno tra width e min_width")
+        self.width = width
+        self.min_width = min_width
+
+    @staticmethod
+    def image_candidates(node):
+        """
+        :param node: dict - json del post (pagine o API ufficiale)
+        :return: list - coppie (larghezza, url) delle rendition dell'immagine
+        """
+        candidates = []
+        for key in ('thumbnail_resources', 'display_resources'):
+            for resource in node.get(key) or ():
+                candidates.append((resource.get('config_width') or 0, resource['src']))
+        for image in (node.get('images') or {}).values():
+            candidates.append((image.get('width') or 0, image['url']))
+        full = node.get('display_url') or node.get('display_src')
+        if full:
+            candidates.append(((node.get('dimensions') or {}).get('width') or 0, full))
+        return candidates
+
+    @staticmethod
+    def video_candidates(node):
+        """
+        :param node: dict - json del post (pagine o API ufficiale)
+        :return: list - coppie (larghezza, url) delle rendition del video
+        """
+        candidates = [
+            (video.get('width') or 0, video['url'])
+            for video in (node.get('videos') or {}).values()
+        ]
+        if node.get('video_url'):
+            candidates.append(((node.get('dimensions') or {}).get('width') or 0, node['video_url']))
+        return candidates
+
+    def choose(self, candidates):
+        """
+        :param candidates: list - coppie (larghezza, url)
+        :return: str - url scelto, None se non ci sono rendition
+        """
+        if not candidates:
+            return None
+        if self.min_width is not None:
+            fitting = [candidate for candidate in candidates if candidate[0] >= self.min_width]
+            if fitting:
+                return min(fitting, key=lambda candidate: candidate[0])[1]
+        elif self.width is not None:
+            # a parità di distanza preferisco la più piccola
+            return min(candidates, key=lambda candidate: (abs(candidate[0] - self.width), candidate[0]))[1]
+        # a parità di larghezza preferisco l'immagine originale (l'ultima della lista)
+        return max(reversed(candidates), key=lambda candidate: candidate[0])[1]
+
+    def image_url(self, node):
+        """
+        :param node: dict - json del post
+        :return: str - url dell'immagine scelta
+        """
+        return self.choose(self.image_candidates(node))
+
+    def video_url(self, node):
+        """
+        :param node: dict - json del post
+        :return: str - url del video scelto
+        """
+        return self.choose(self.video_candidates(node))
+
+
+class FieldExtractor(object):
+    """
+    Estrattore di campi "compilato": a partire da un dizionario
+    campo -> percorso puntato restituisce, per ogni nodo, un
+    dizionario campo -> valore (None se il percorso non esiste).
+
+    Esempio:
+
+     >>> extractor = FieldExtractor(HASHTAG_FIELDS).extend(thumbnails='thumbnail_resources')
+     >>> rows = extractor.extract_many(node for node in nodes)
+    """
+    def __init__(self, fields):
+        """
+        :param fields: dict - campo -> percorso puntato nel json
+        """
+        self.fields = dict(fields)
+        self._paths = tuple(
+            (name, tuple(int(key) if key.isdigit() else key for key in path.split('.')))
+            for name, path in self.fields.items()
+        )
+
+    def extend(self, fields=None, **kwargs):
+        """
+        :param fields: dict - campi aggiuntivi (o da sovrascrivere)
+        :return: FieldExtractor - nuovo estrattore con i campi aggiunti
+        """
+        return FieldExtractor(dict(self.fields, **dict(fields or {}, **kwargs)))
+
+    def only(self, names):
+        """
+        :param names: iterable - campi da tenere
+        :return: FieldExtractor - nuovo estrattore con i soli campi richiesti
+        """
+        return FieldExtractor({name: path for name, path in self.fields.items() if name in names})
+
+    def extract(self, node):
+        """
+        :param node: dict - json del post
+        :return: dict - campo -> valore
+        """
+        values = {}
+        for name, path in self._paths:
+            value = node
+            try:
+                for key in path:
+                    value = value[key]
+            except (KeyError, IndexError, TypeError):
+                value = None
+            values[name] = value
+        return values
+
+    __call__ = extract
+
+    def extract_many(self, nodes):
+        """
+        :param nodes: iterable - json dei post (es. quelli di una pagina)
+        :return: list - un dizionario campo -> valore per ogni post
+        """
+        extract = self.extract
+        return [extract(node) for node in nodes]
+
+
+class Converter(object):
+    """
+    Trasforma i json dei post nel formato di output richiesto:
+
+      - 'json': il json originale, senza modifiche
+      - 'dict': un dizionario con i soli campi estratti
+      - 'orm': oggetti Media (SqlAlchemy)
+      - 'records': oggetti MediaRecord (più leggeri)
+
+    Con 'orm' e 'records' vengono usati solo i campi del model; i
+    campi aggiuntivi sono disponibili con 'dict'. Con una
+    RenditionPolicy il campo url viene scelto tra le rendition
+    dell'immagine invece di essere sempre quella a piena risoluzione.
+    """
+    # classi usate per i formati 'orm' e 'records'
+    models = (Media, MediaRecord)
+
+    def __init__(self, fields, as_='orm', raw_json=False, rendition=None):
+        """
+        :param fields: dict or FieldExtractor - campi da estrarre
+        :param as_: str - formato di output
+        :param raw_json: bool - con 'orm' e 'records', salva in json la stringa
+                                del json del post invece del dizionario
+        :param rendition: RenditionPolicy - regola per scegliere l'url dell'immagine
+        """
+        if as_ not in OUTPUTS:
+            raise ValueError("Il parametro as_ deve essere uno tra: {}".format(", ".join(OUTPUTS)))
+        self.as_ = as_
+        self.raw_json = raw_json
+        self.rendition = rendition
+        self.extractor = fields if isinstance(fields, FieldExtractor) else FieldExtractor(fields)
+        if as_ in ('orm', 'records'):
+            model, record = self.models
+            self.factory = model if as_ == 'orm' else record
+            self.extractor = self.extractor.only(record.__slots__)
+
+    def convert(self, node):
+        """
+        :param node: dict - json del post
+        :return: il post nel formato richiesto
+        """
+        return self.convert_many((node, ))[0]
+
+    __call__ = convert
+
+    def convert_many(self, nodes, **values):
+        """
+        :param nodes: list - json dei post di una pagina
+        :param values: campi con lo stesso valore per tutti i nodi
+        :return: list - i post nel formato richiesto
+        """
+        if self.as_ == 'json':
+            return list(nodes)
+        rows = self.extractor.extract_many(nodes)
+        if values:
+            for row in rows:
+                row.update(values)
+        if self.rendition is not None:
+            image_url = self.rendition.image_url
+            for node, row in zip(nodes, rows):
+                if 'url' in row:
+                    row['url'] = image_url(node) or row['url']
+        if self.as_ == 'dict':
+            return rows
+        factory = self.factory
+        encode = jsonlib.dumps if self.raw_json else None
+        items = []
+        for node, row in zip(nodes, rows):
+            item = factory(**row)
+            item.json = encode(node) if encode else node
+            items.append(item)
+        return items
+
+
+class CommentConverter(Converter):
+    """
+    Come Converter, ma per i commenti di un post: 'orm' restituisce
+    oggetti Comment e 'records' oggetti CommentRecord.
+    """
+    models = (Comment, CommentRecord)
+
+    def __init__(self, as_='orm', raw_json=False):
+        """
+        :param as_: str - formato di output
+        :param raw_json: bool - con 'orm' e 'records', salva in json la stringa
+                                del json del commento invece del dizionario
+        """
+        super(CommentConverter, self).__init__(COMMENT_FIELDS, as_, raw_json)
+
+    def convert_comments(self, media, nodes):
+        """
+        :param media: dict - json del post (graphql.shortcode_media)
+        :param nodes: list - json dei commenti di una pagina
+        :return: list - i commenti nel formato richiesto
+        """
+        return self.convert_many(nodes, id_immagine=media['id'], code=media['shortcode'])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Codifica e decodifica JSON.
+
+Se installate, vengono usate orjson o pysimdjson (molto più veloci
+della libreria standard sulle pagine di Instagram); altrimenti si
+ripiega sul modulo json. I client accettano anche una funzione di
+decodifica personalizzata.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+def _json_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8')
+
+
+DECODERS = {'json': _json_loads}
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+if simdjson is not None:
+    DECODERS['simdjson'] = simdjson.loads
+
+
+def get_decoder(name=None):
+    """
+    :param name: str - 'orjson', 'simdjson' o 'json' (None = la più veloce disponibile)
+    :return: callable - funzione che decodifica bytes o str
+    """
+    if name is None:
+        for name in ('orjson', 'simdjson', 'json'):
+            if name in DECODERS:
+                break
+    try:
+        return DECODERS[name]
+    except KeyError:
+        raise ValueError("Decoder JSON non disponibile: {}".format(name))
+
+
+# decodifica e codifica (in str) con la libreria più veloce disponibile
+loads = get_decoder()
+dumps = _orjson_dumps if orjson is not None else _json_dumps
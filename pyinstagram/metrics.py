@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Strumentazione delle richieste dei client.
+
+Ogni richiesta genera un RequestEvent (latenza, codice di stato,
+byte ricevuti, tempo di decodifica del json, tentativi e attese),
+passato a tutti gli hook registrati sul client. Metrics è un hook
+già pronto che aggrega gli eventi per tipo di endpoint e li esporta
+come dizionario o nel formato testuale di Prometheus.
+"""
+import threading
+
+
+class RequestEvent(object):
+    """
+    Misure di una richiesta (o di un'attesa, se status è None).
+    """
+
+    __slots__ = ('kind', 'url', 'status', 'latency', 'bytes', 'parse_time', 'retries', 'sleep', 'from_cache')
+
+    def __init__(self, kind, url=None, status=None, latency=0.0, bytes=0, parse_time=0.0, retries=0, sleep=0.0,
+                 from_cache=False):
+        """
+        :param kind: str - tipo di endpoint ('user', 'tag', 'post', 'profile', 'comments', 'search')
+        :param url: str - url richiesto
+        :param status: int - codice di stato HTTP (None per le sole attese)
+        :param latency: float - secondi trascorsi tra la richiesta e la risposta
+        :param bytes: int - byte ricevuti
+        :param parse_time: float - secondi spesi a decodificare il json
+        :param retries: int - tentativi falliti prima di questo (es. per un 429)
+        :param sleep: float - secondi di attesa (rate limit o pause)
+        :param from_cache: bool - risposta servita dalla cache
+        """
+        self.kind = kind
+        self.url = url
+        self.status = status
+        self.latency = latency
+        self.bytes = bytes
+        self.parse_time = parse_time
+        self.retries = retries
+        self.sleep = sleep
+        self.from_cache = from_cache
+
+    def __repr__(self):
+        return "<RequestEvent (kind='{kind}', status={status}, latency={latency:.3f})>".format(
+            kind=self.kind, status=self.status, latency=self.latency
+        )
+
+
+class Metrics(object):
+    """
+    Hook che aggrega gli eventi delle richieste per tipo di endpoint.
+
+    Esempio:
+
+     >>> metrics = Metrics()
+     >>> app = InstagramJsonClient(hooks=[metrics])
+     >>> app.get_by_hashtag("mfw", top_posts=False)
+     >>> metrics.stats()['tag']['latency']
+     >>> print(metrics.to_prometheus())
+    """
+    # limiti (in secondi) dell'istogramma delle latenze
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _new(self):
+        return {
+            'requests': 0,
+            'errors': 0,
+            'cache_hits': 0,
+            'bytes': 0,
+            'latency': 0.0,
+            'parse_time': 0.0,
+            'retries': 0,
+            'sleep': 0.0,
+            'status': {},
+            'buckets': [0] * len(self.BUCKETS),
+        }
+
+    def __call__(self, event):
+        """
+        :param event: RequestEvent - evento da aggregare
+        :return: None
+        """
+        with self._lock:
+            stats = self._stats.get(event.kind)
+            if stats is None:
+                stats = self._stats[event.kind] = self._new()
+            stats['sleep'] += event.sleep
+            if event.status is None:
+                return
+            stats['requests'] += 1
+            stats['errors'] += event.status >= 400
+            stats['cache_hits'] += event.from_cache
+            stats['bytes'] += event.bytes
+            stats['latency'] += event.latency
+            stats['parse_time'] += event.parse_time
+            # ogni evento è un tentativo: conto quelli che ripetono una richiesta
+            stats['retries'] += event.retries > 0
+            stats['status'][event.status] = stats['status'].get(event.status, 0) + 1
+            for index, limit in enumerate(self.BUCKETS):
+                if event.latency <= limit:
+                    stats['buckets'][index] += 1
+                    break
+
+    def stats(self):
+        """
+        :return: dict - per ogni tipo di endpoint: richieste, errori, risposte dalla cache,
+                        byte, secondi totali di latenza, decodifica e attesa, tentativi
+                        ripetuti e numero di risposte per codice di stato
+        """
+        with self._lock:
+            result = {}
+            for kind, stats in self._stats.items():
+                result[kind] = {key: value for key, value in stats.items() if key != 'buckets'}
+                result[kind]['status'] = dict(stats['status'])
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_prometheus(self, prefix='pyinstagram'):
+        """
+        :param prefix: str - prefisso dei nomi delle metriche
+        :return: str - metriche nel formato testuale di Prometheus
+        """
+        lines = []
+        with self._lock:
+            stats = {kind: dict(values, status=dict(values['status']), buckets=list(values['buckets']))
+                     for kind, values in self._stats.items()}
+
+        def metric(name, kind_, help_, key):
+            lines.append("# HELP {0}_{1} {2}".format(prefix, name, help_))
+            lines.append("# TYPE {0}_{1} {2}".format(prefix, name, kind_))
+            for kind, values in sorted(stats.items()):
+                lines.append('{0}_{1}{{kind="{2}"}} {3}'.format(prefix, name, kind, values[key]))
+
+        lines.append("# HELP {}_requests_total Richieste effettuate".format(prefix))
+        lines.append("# TYPE {}_requests_total counter".format(prefix))
+        for kind, values in sorted(stats.items()):
+            for status, count in sorted(values['status'].items()):
+                lines.append('{0}_requests_total{{kind="{1}",status="{2}"}} {3}'.format(prefix, kind, status, count))
+        metric('cache_hits_total', 'counter', "Risposte servite dalla cache", 'cache_hits')
+        metric('received_bytes_total', 'counter', "Byte ricevuti", 'bytes')
+        metric('parse_seconds_total', 'counter', "Secondi spesi a decodificare il json", 'parse_time')
+        metric('retries_total', 'counter', "Richieste ripetute", 'retries')
+        metric('sleep_seconds_total', 'counter', "Secondi di attesa (rate limit e pause)", 'sleep')
+
+        name = "{}_request_duration_seconds".format(prefix)
+        lines.append("# HELP {} Latenza delle richieste".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for kind, values in sorted(stats.items()):
+            cumulative = 0
+            for limit, count in zip(self.BUCKETS, values['buckets']):
+                cumulative += count
+                lines.append('{0}_bucket{{kind="{1}",le="{2}"}} {3}'.format(name, kind, limit, cumulative))
+            lines.append('{0}_bucket{{kind="{1}",le="+Inf"}} {2}'.format(name, kind, values['requests']))
+            lines.append('{0}_sum{{kind="{1}"}} {2}'.format(name, kind, values['latency']))
+            lines.append('{0}_count{{kind="{1}"}} {2}'.format(name, kind, values['requests']))
+        return "\n".join(lines) + "\n"
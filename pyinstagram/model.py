@@ -11,9 +11,16 @@ from sqlalchemy import Column, Integer, String, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 
+from . import jsonlib
+
 Base = declarative_base()
 
 
+def _decode(value):
+    """Il campo json può contenere il dizionario o la sua codifica in stringa"""
+    return jsonlib.loads(value) if isinstance(value, (str, bytes)) else value
+
+
 class Media(Base):
     """
     Model che mappa un'immagine (o un video)
@@ -38,12 +45,60 @@ class Media(Base):
     def created_at(self):
         return datetime.fromtimestamp(int(self.unix_datetime))
 
+    @property
+    def data(self):
+        """Il json del post come dizionario (decodificato se salvato come stringa)"""
+        return _decode(self.json)
+
     def __repr__(self):
         return "<Image (id='{id}', caption='{caption}')>".format(
             id=self.id, caption=self.caption[:25]
         )
 
 
+class MediaRecord(object):
+    """
+    Versione leggera di Media: stessi campi, ma senza la
+    strumentazione di SqlAlchemy. Da usare quando i dati non
+    devono finire (subito) su un database.
+    """
+
+    __slots__ = ('id', 'height', 'width', 'url', 'comments', 'likes', 'caption',
+                 'is_video', 'user', 'unix_datetime', 'json', 'code')
+
+    model = Media
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field))
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(int(self.unix_datetime))
+
+    @property
+    def data(self):
+        """Il json del post come dizionario (decodificato se salvato come stringa)"""
+        return _decode(self.json)
+
+    def to_dict(self):
+        """
+        :return: dict - i campi del media
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def to_orm(self):
+        """
+        :return: Media - oggetto SqlAlchemy con gli stessi dati
+        """
+        return Media(**self.to_dict())
+
+    def __repr__(self):
+        return "<ImageRecord (id='{id}', caption='{caption}')>".format(
+            id=self.id, caption=(self.caption or '')[:25]
+        )
+
+
 class Comment(Base):
     """
     Model che mappa un commento
@@ -65,5 +120,45 @@ class Comment(Base):
 
     def __repr__(self):
         return "<Comment (id='{id}', caption='{text}')>".format(
-            id=self.id, text=self.text[:25]
+            id=self.id_commento, text=(self.text or '')[:25]
+        )
+
+
+class CommentRecord(object):
+    """
+    Versione leggera di Comment, come MediaRecord per Media.
+    """
+
+    __slots__ = ('id_immagine', 'id_commento', 'username', 'text', 'unix_datetime', 'json', 'code')
+
+    model = Comment
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field))
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(int(self.unix_datetime))
+
+    @property
+    def data(self):
+        """Il json del commento come dizionario (decodificato se salvato come stringa)"""
+        return _decode(self.json)
+
+    def to_dict(self):
+        """
+        :return: dict - i campi del commento
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def to_orm(self):
+        """
+        :return: Comment - oggetto SqlAlchemy con gli stessi dati
+        """
+        return Comment(**self.to_dict())
+
+    def __repr__(self):
+        return "<CommentRecord (id='{id}', text='{text}')>".format(
+            id=self.id_commento, text=(self.text or '')[:25]
         )
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import requests
+from .transport import Transport
 
 
 class OAuth(object):
@@ -9,8 +9,10 @@ class OAuth(object):
 
     _SCOPES = ("basic", "public_content", "follower_list", "comments", "relationships", "likes")
 
-    def __init__(self, access_token=None, client_id=None, client_secret=None, authorization_redirect_uri=None, scopes=None):
+    def __init__(self, access_token=None, client_id=None, client_secret=None, authorization_redirect_uri=None, scopes=None,
+                 transport=None):
         self.access_token = access_token
+        self.transport = transport or Transport()
         self.client_id = client_id
         self.client_secret = client_secret
         self.authorization_redirect_uri = authorization_redirect_uri
@@ -53,7 +55,7 @@ class OAuth(object):
             'redirect_uri': self.authorization_redirect_uri,
             'code': code,
         }
-        response = requests.post('https://api.instagram.com/oauth/access_token', data=data)
+        response = self.transport.post('https://api.instagram.com/oauth/access_token', data=data)
         try:
             res_json = response.json()
             self.access_token = res_json['access_token']
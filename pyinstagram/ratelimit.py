@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Gestione dei limiti di richieste delle API ufficiali Instagram.
+
+Invece di aspettare un'ora alla prima risposta 429, le richieste
+vengono distribuite nel tempo con un token bucket, aggiornato con
+i valori degli header X-Ratelimit-Limit e X-Ratelimit-Remaining
+restituiti dalle API. Con più access token (TokenPool) ogni token
+ha il proprio bucket e le richieste vanno al token con più quota.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter(object):
+    """
+    Token bucket thread-safe: ogni richiesta consuma un gettone e i
+    gettoni si ricaricano a una velocità di limit/period al secondo.
+    Se i gettoni sono finiti, acquire() attende solo il tempo
+    necessario a ricaricarne uno.
+
+    Lo stesso oggetto può essere condiviso da più thread (o da più
+    client che usano lo stesso access token).
+    """
+    def __init__(self, limit=5000, period=3600):
+        """
+        :param limit: int - richieste consentite per periodo
+        :param period: float - durata del periodo in secondi
+        """
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.strikes = 0
+        self._updated = time.monotonic()
+        # dopo un 429 nessuna richiesta parte prima di questo istante
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """Gettoni ricaricati al secondo"""
+        return self.limit / self.period
+
+    def available(self):
+        """
+        :return: float - gettoni disponibili (negativi se ci sono richieste in attesa
+                         o se il token è fermo per un 429)
+        """
+        with self._lock:
+            self._refill()
+            blocked = self._blocked_until - self._updated
+            if blocked > 0:
+                return min(self.tokens, 0) - blocked * self.rate
+            return self.tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Prenota un gettone, attendendo se necessario. Le attese di
+        più thread si accodano: ognuno aspetta il proprio turno, e
+        comunque non prima della fine dell'attesa imposta da un 429.
+
+        :return: float - secondi di attesa
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate if self.tokens < 0 else 0,
+                       self._blocked_until - self._updated, 0)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def update(self, headers):
+        """
+        Aggiorna il bucket con i valori restituiti dalle API.
+
+        :param headers: dict - header della risposta
+        :return: None
+        """
+        try:
+            limit = int(headers['X-Ratelimit-Limit'])
+            remaining = int(headers['X-Ratelimit-Remaining'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._lock:
+            self._refill()
+            self.limit = limit
+            # il server ha sempre ragione, sia se ci restano meno richieste del previsto
+            # sia se la quota si è già ricaricata (es. dopo un 429 passeggero)
+            self.tokens = float(min(limit, remaining))
+            if remaining:
+                self.strikes = 0
+
+    def backoff(self, retry_after=None):
+        """
+        Da chiamare quando le API rispondono 429: ritarda le prossime
+        richieste del tempo indicato da Retry-After, senza toccare i
+        gettoni (che restano quelli riportati dal server). Se il server
+        non indica quanto aspettare, l'attesa raddoppia a ogni 429
+        consecutivo, fino a un massimo di un periodo.
+
+        :param retry_after: str or int - valore dell'header Retry-After
+        :return: float - secondi di attesa imposti alle prossime richieste
+        """
+        with self._lock:
+            self._refill()
+            self.strikes += 1
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                wait = min(self.period, 2 ** (self.strikes - 1) / self.rate)
+            self._blocked_until = max(self._blocked_until, self._updated + wait)
+        return wait
+
+
+class TokenPool(object):
+    """
+    Insieme di access token (ad esempio di più app autorizzate), ognuno
+    con il proprio RateLimiter. Ogni richiesta usa il token con più
+    richieste residue; un token esaurito resta fuori dalla rotazione
+    finché il suo bucket non si ricarica. Le pagine successive di una
+    ricerca restano sul token che l'ha iniziata, finché ha quota.
+
+    Esempio:
+
+     >>> pool = TokenPool(["token1", "token2", "token3"])
+     >>> app = InstagramApiClient(pool)
+     >>> app.get_by_hashtag(("mfw", "lfw", "pfw"), workers=3)
+     >>> pool.available()
+    """
+    def __init__(self, tokens, limit=5000, period=3600):
+        """
+        :param tokens: iterable - access token, o coppie (access token, RateLimiter)
+        :param limit: int - richieste consentite per periodo a ogni token
+        :param period: float - durata del periodo in secondi
+        """
+        self._limiters = OrderedDict()
+        for token in tokens:
+            token, limiter = token if isinstance(token, tuple) else (token, RateLimiter(limit, period))
+            self._limiters[token] = limiter
+        if not self._limiters:
+            raise ValueError("Serve almeno un access token")
+
+    def __len__(self):
+        return len(self._limiters)
+
+    @property
+    def tokens(self):
+        return list(self._limiters)
+
+    def limiter(self, token):
+        """
+        :param token: str - access token
+        :return: RateLimiter - bucket del token
+        """
+        return self._limiters[token]
+
+    def choose(self, preferred=None):
+        """
+        :param preferred: str - token da usare se ha ancora quota (es. quello
+                                con cui è iniziata la paginazione)
+        :return: str - access token da usare per la prossima richiesta
+        """
+        if preferred in self._limiters and self._limiters[preferred].available() >= 1:
+            return preferred
+        # il token con più gettoni: se sono tutti esauriti, quello che si ricarica prima
+        return max(self._limiters, key=lambda token: self._limiters[token].available())
+
+    def available(self):
+        """
+        :return: dict - gettoni disponibili per ogni token
+        """
+        return OrderedDict((token, limiter.available()) for token, limiter in self._limiters.items())
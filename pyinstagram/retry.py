@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Politica unica di ripetizione delle richieste fallite, usata da
+entrambi i client.
+
+Ogni risposta (o eccezione) viene classificata come riuscita, da
+ripetere (errori temporanei: 429, 5xx, problemi di rete) o definitiva
+(es. post o hashtag non più esistenti, che non vale la pena ripetere).
+Le attese crescono in modo esponenziale fino a un massimo, con una
+componente casuale (jitter) per non far ripartire insieme tutti i
+thread; un budget limita il numero totale di ripetizioni di una
+ricerca. Nel client delle API l'attesa dopo un 429 la decide il rate
+limiter, ma i 429 hanno comunque un limite di tentativi e consumano
+il budget.
+"""
+import random
+import threading
+
+import requests
+
+# esiti di classify()
+OK = 'ok'
+RETRY = 'retry'
+FAIL = 'fail'
+
+NOT_AVAILABLE = "Sorry, this page isn't available"
+
+
+class RetryPolicy(object):
+    """
+    Esempio:
+
+     >>> retry = RetryPolicy(max_attempts=4, base=2, cap=30, budget=100)
+     >>> app = InstagramJsonClient(retry=retry)
+     >>> app.get_by_hashtag(tags, top_posts=False)
+     >>> retry.retries
+
+    La stessa politica può essere condivisa da più thread e più
+    ricerche contemporanee: ogni ricerca ha il proprio RetryBudget.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, max_attempts=5, base=1.0, cap=60.0, jitter=True, budget=None,
+                 retry_statuses=None, retry_exceptions=None):
+        """
+        :param max_attempts: int - tentativi massimi per ogni richiesta (compreso il primo)
+        :param base: float - attesa (secondi) prima della prima ripetizione
+        :param cap: float - attesa massima (secondi)
+        :param jitter: bool - attesa casuale tra 0 e il valore esponenziale ("full jitter")
+        :param budget: int - ripetizioni consentite per ricerca (None = nessun limite), condivise
+                             da tutte le richieste della ricerca
+        :param retry_statuses: tuple - codici di stato HTTP da ripetere
+        :param retry_exceptions: tuple - eccezioni da ripetere
+        """
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.budget = budget
+        self.retry_statuses = tuple(retry_statuses or self.RETRY_STATUSES)
+        self.retry_exceptions = tuple(retry_exceptions or self.RETRY_EXCEPTIONS)
+        # ripetizioni totali, di tutte le ricerche
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def classify(self, response=None, exception=None):
+        """
+        :param response: requests.Response - risposta ricevuta
+        :param exception: Exception - eccezione sollevata dalla richiesta
+        :return: str - OK, RETRY o FAIL
+        """
+        if exception is not None:
+            return RETRY if isinstance(exception, self.retry_exceptions) else FAIL
+        if response.status_code in self.retry_statuses:
+            return RETRY
+        if response.status_code == 404 or (
+                response.status_code != 200 and NOT_AVAILABLE in response.text):
+            return FAIL
+        return OK
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :param attempt: int - tentativi già falliti (1 = prima ripetizione)
+        :param retry_after: str or float - valore dell'header Retry-After, se presente
+        :return: float - secondi da attendere prima del prossimo tentativo
+        """
+        wait = min(self.cap, self.base * 2 ** (attempt - 1))
+        if self.jitter:
+            wait = random.uniform(0, wait)
+        try:
+            # il server sa meglio di noi quanto aspettare
+            wait = max(wait, min(self.cap, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        return wait
+
+    def new_budget(self):
+        """
+        :return: RetryBudget - budget di una nuova ricerca
+        """
+        return RetryBudget(self.budget)
+
+    def allow(self, attempt, budget=None):
+        """
+        Decide se una richiesta fallita può essere ripetuta,
+        consumando una ripetizione dal budget della ricerca.
+
+        :param attempt: int - tentativi già falliti per questa richiesta
+        :param budget: RetryBudget - budget della ricerca (None = nessun limite)
+        :return: bool
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if budget is not None and not budget.spend():
+            return False
+        with self._lock:
+            self.retries += 1
+        return True
+
+
+class RetryBudget(object):
+    """
+    Ripetizioni consumate da una singola ricerca. Viene creato da
+    RetryPolicy.new_budget() all'inizio di ogni get_*/iter_* e
+    condiviso da tutte le richieste della ricerca, anche se eseguite
+    da più thread.
+    """
+    def __init__(self, limit=None):
+        """
+        :param limit: int - ripetizioni consentite (None = nessun limite)
+        """
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """
+        Consuma una ripetizione, se il budget lo consente.
+
+        :return: bool
+        """
+        with self._lock:
+            if self.limit is not None and self.spent >= self.limit:
+                return False
+            self.spent += 1
+        return True
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+Esecuzione di molte ricerche (utenti, hashtag e post) su più processi.
+
+Le ricerche da fare sono job salvati in una coda SQLite: ogni processo
+avvia alcuni thread (per tenere aperte più connessioni) che prendono un
+job alla volta in prestito ("lease") per un certo tempo, rinnovandolo
+mentre lavorano. Se un processo muore, alla scadenza del lease il job
+torna disponibile e viene ripreso dall'ultima pagina salvata (i cursori
+vengono salvati nello stesso database). I post trovati negli hashtag e
+nei profili possono essere aggiunti alla coda come nuovi job.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from .base import InstagramJsonClient
+from .checkpoint import CheckpointStore
+from .exceptions import PyInstagramException
+
+# stati di un job
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+KINDS = ('user', 'tag', 'post')
+
+
+class Job(object):
+    """
+    Job preso in prestito dalla coda.
+    """
+
+    __slots__ = ('id', 'kind', 'target', 'params', 'attempts')
+
+    def __init__(self, id, kind, target, params=None, attempts=0):
+        """
+        :param id: int - id del job nella coda
+        :param kind: str - 'user', 'tag' o 'post'
+        :param target: str - username, hashtag o codice del post
+        :param params: dict - parametri aggiuntivi della ricerca (es. since, until, count)
+        :param attempts: int - tentativi fatti, compreso quello in corso
+        """
+        self.id = id
+        self.kind = kind
+        self.target = target
+        self.params = params or {}
+        self.attempts = attempts
+
+    def __repr__(self):
+        return "<Job (kind='{kind}', target='{target}')>".format(kind=self.kind, target=self.target)
+
+
+class JobQueue(object):
+    """
+    Coda persistente dei job su SQLite, condivisibile tra processi.
+    Ogni coppia (tipo, target) viene inserita una sola volta.
+
+    Esempio:
+
+     >>> queue = JobQueue("crawl.db")
+     >>> queue.put('tag', 'mfw', since="20170101000000")
+     >>> job = queue.claim("worker-1", lease=60)
+     >>> queue.complete(job, "worker-1", items=1200)
+    """
+    def __init__(self, path, max_attempts=3):
+        """
+        :param path: str - file SQLite della coda
+        :param max_attempts: int - tentativi dopo i quali un job viene segnato come fallito
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, kind TEXT, target TEXT, params TEXT, priority INTEGER DEFAULT 0, "
+            "state TEXT, attempts INTEGER DEFAULT 0, worker TEXT, lease_until REAL, items INTEGER DEFAULT 0, "
+            "error TEXT, created REAL, updated REAL, UNIQUE (kind, target))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, id)")
+
+    def put(self, kind, target, priority=0, **params):
+        """
+        :param kind: str - 'user', 'tag' o 'post'
+        :param target: str - username, hashtag o codice del post
+        :param priority: int - i job con priorità più alta vengono presi per primi
+        :param params: parametri aggiuntivi della ricerca (es. since, until, count, seek)
+        :return: bool - True se il job è nuovo
+        """
+        return self.put_many(kind, (target, ), priority, **params) == 1
+
+    def put_many(self, kind, targets, priority=0, **params):
+        """
+        :param kind: str - 'user', 'tag' o 'post'
+        :param targets: iterable - username, hashtag o codici dei post
+        :param priority: int - i job con priorità più alta vengono presi per primi
+        :param params: parametri aggiuntivi, uguali per tutti i job
+        :return: int - numero di job nuovi (quelli già in coda vengono ignorati)
+        """
+        if kind not in KINDS:
+            raise PyInstagramException("Tipo di job sconosciuto: {}".format(kind))
+        now = time.time()
+        encoded = json.dumps(params, sort_keys=True)
+        rows = [(kind, str(target), encoded, priority, PENDING, now, now) for target in targets]
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO jobs (kind, target, params, priority, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.execute("COMMIT")
+            return self._db.total_changes - before
+
+    def claim(self, worker, lease=300):
+        """
+        Prende in prestito il prossimo job disponibile (in attesa, o
+        con un lease scaduto perché il suo worker si è fermato).
+
+        :param worker: str - nome del worker
+        :param lease: float - secondi di validità del prestito
+        :return: Job - None se non ci sono job disponibili
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # i job che hanno fatto scadere il lease troppe volte non vengono più ripresi
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, error = ?, updated = ? "
+                    "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "lease scaduto", now, LEASED, now, self.max_attempts)
+                )
+                row = self._db.execute(
+                    "SELECT id, kind, target, params, attempts FROM jobs "
+                    "WHERE state = ? OR (state = ? AND lease_until < ?) "
+                    "ORDER BY priority DESC, id LIMIT 1", (PENDING, LEASED, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated = ? WHERE id = ?", (LEASED, worker, now + lease, now, row[0])
+                    )
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+
+    def _update(self, query, params):
+        with self._lock:
+            return self._db.execute(query, params).rowcount == 1
+
+    def renew(self, job, worker, lease=300, items=0):
+        """
+        :param job: Job - job in prestito
+        :param worker: str - nome del worker
+        :param lease: float - secondi di validità del prestito, da adesso
+        :param items: int - risultati prodotti finora
+        :return: bool - False se il prestito è scaduto e il job è passato a un altro worker
+        """
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET lease_until = ?, items = ?, updated = ? WHERE id = ? AND worker = ? AND state = ?",
+            (now + lease, items, now, job.id, worker, LEASED)
+        )
+
+    def complete(self, job, worker, items=0):
+        """
+        :param job: Job - job in prestito
+        :param worker: str - nome del worker
+        :param items: int - risultati prodotti
+        :return: bool - False se il prestito era scaduto
+        """
+        return self._update(
+            "UPDATE jobs SET state = ?, items = ?, lease_until = NULL, error = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND state = ?", (DONE, items, time.time(), job.id, worker, LEASED)
+        )
+
+    def fail(self, job, worker, error, items=0):
+        """
+        Rimette in coda un job fallito, o lo segna come fallito se
+        ha esaurito i tentativi.
+
+        :param job: Job - job in prestito
+        :param worker: str - nome del worker
+        :param error: str - descrizione dell'errore
+        :param items: int - risultati prodotti prima dell'errore
+        :return: bool - False se il prestito era scaduto
+        """
+        state = FAILED if job.attempts >= self.max_attempts else PENDING
+        return self._update(
+            "UPDATE jobs SET state = ?, items = ?, lease_until = NULL, error = ?, updated = ? "
+            "WHERE id = ? AND worker = ? AND state = ?",
+            (state, items, error, time.time(), job.id, worker, LEASED)
+        )
+
+    def counts(self):
+        """
+        :return: dict - numero di job per stato e risultati prodotti in totale ('items')
+        """
+        result = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        result['items'] = 0
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*), SUM(items) FROM jobs GROUP BY state").fetchall()
+        for state, count, items in rows:
+            result[state] = count
+            result['items'] += items or 0
+        return result
+
+    def close(self):
+        self._db.close()
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+def _code(item):
+    """Codice del post di un risultato, in qualsiasi formato"""
+    if isinstance(item, dict):
+        return item.get('code') or item.get('shortcode')
+    return getattr(item, 'code', None)
+
+
+class _Worker(object):
+    """
+    Thread di un processo del Scheduler: prende job dalla coda
+    finché ce ne sono, anche tra quelli scoperti dagli altri worker.
+    """
+    def __init__(self, name, queue, client, sink, options):
+        self.name = name
+        self.queue = queue
+        self.client = client
+        self.sink = sink
+        self.lease = options['lease']
+        self.as_ = options['as_']
+        self.discover = options['discover']
+        self.poll_interval = options['poll_interval']
+        self.items = 0
+        self.lost = False
+
+    def run(self):
+        while True:
+            job = self.queue.claim(self.name, self.lease)
+            if job is None:
+                counts = self.queue.counts()
+                if not counts[PENDING] and not counts[LEASED]:
+                    return
+                # altri worker stanno lavorando e possono aggiungere job
+                time.sleep(self.poll_interval)
+                continue
+            self.items = 0
+            self.lost = False
+            # il lease viene rinnovato da un thread a parte, anche quando il job passa
+            # molto tempo senza produrre risultati (pagine filtrate da since/until, attese)
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+            heartbeat.start()
+            try:
+                items = self._track(job, self._iter(job))
+                if self.sink is not None:
+                    self.sink.write_many(items)
+                else:
+                    for _ in items:
+                        pass
+            except _LeaseLost:
+                # il job è passato a un altro worker
+                continue
+            except Exception as e:
+                self.queue.fail(job, self.name, "{}: {}".format(type(e).__name__, e), self.items)
+            else:
+                self.queue.complete(job, self.name, self.items)
+            finally:
+                stop.set()
+                heartbeat.join()
+
+    def _heartbeat(self, job, stop):
+        """Rinnova il lease del job ogni terzo della sua durata, finché il job è in corso"""
+        while not stop.wait(self.lease / 3.0):
+            if not self.queue.renew(job, self.name, self.lease, self.items):
+                self.lost = True
+                return
+
+    def _iter(self, job):
+        params = dict(job.params)
+        if job.kind == 'user':
+            return self.client.iter_by_user(job.target, resume=True, as_=self.as_, **params)
+        if job.kind == 'tag':
+            params.setdefault('top_posts', False)
+            return self.client.iter_by_hashtag(job.target, resume=True, as_=self.as_, **params)
+        return self.client.iter_by_media_codes(job.target, as_=self.as_, **params)
+
+    def _track(self, job, items):
+        """
+        Conta i risultati del job, si ferma se il lease è passato a un
+        altro worker e aggiunge alla coda i post trovati.
+        """
+        codes = []
+        discover = self.discover and job.kind != 'post'
+        for item in items:
+            if self.lost:
+                raise _LeaseLost()
+            self.items += 1
+            if discover:
+                code = _code(item)
+                if code:
+                    codes.append(code)
+            yield item
+            if len(codes) >= 100:
+                self.queue.put_many('post', codes)
+                codes = []
+        if self.lost:
+            raise _LeaseLost()
+        if codes:
+            self.queue.put_many('post', codes)
+
+
+def _work(path, index, options):
+    """
+    Corpo di un processo del Scheduler: avvia i thread e attende che
+    la coda sia vuota.
+    """
+    queue = JobQueue(path, options['max_attempts'])
+    client = (options['client_factory'] or InstagramJsonClient)()
+    if client.checkpoints is None:
+        # i cursori vengono salvati nella coda, così un job ripreso riparte dall'ultima pagina
+        client.checkpoints = CheckpointStore(path)
+    workers = []
+    for thread in range(options['threads']):
+        name = "{host}-{pid}-{index}-{thread}".format(host=socket.gethostname(), pid=os.getpid(), index=index,
+                                                      thread=thread)
+        sink_factory = options['sink_factory']
+        sink = sink_factory("w{}-{}".format(index, thread)) if sink_factory else None
+        workers.append(_Worker(name, queue, client, sink, options))
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for worker in workers:
+        if worker.sink is not None:
+            worker.sink.close()
+    queue.close()
+
+
+class Scheduler(object):
+    """
+    Esegue i job di una JobQueue su più processi, ognuno con più
+    thread, fino a svuotare la coda.
+
+    client_factory e sink_factory vengono chiamate in ogni processo
+    (sink_factory una volta per thread, con un nome diverso da usare
+    ad esempio come prefisso dei file): devono essere funzioni definite
+    a livello di modulo se il sistema avvia i processi con "spawn".
+
+    Esempio:
+
+     >>> def sink(name):
+     >>>     return NDJSONSink("out", prefix=name)
+     >>>
+     >>> scheduler = Scheduler("crawl.db", processes=4, threads=8, sink_factory=sink, discover=True)
+     >>> scheduler.add_tags(("mfw", "milanofashionweek"), since="20170901000000")
+     >>> scheduler.add_users(("nasa", "cern"))
+     >>> scheduler.run(report=print)
+    """
+    def __init__(self, path, processes=None, threads=4, lease=300, client_factory=None, sink_factory=None,
+                 as_='records', discover=False, max_attempts=3, poll_interval=1.0):
+        """
+        :param path: str - file SQLite della coda (e dei cursori delle ricerche)
+        :param processes: int - processi da avviare (di default uno per core)
+        :param threads: int - thread, e quindi richieste contemporanee, per processo
+        :param lease: float - secondi di validità del prestito di un job, rinnovato mentre
+                              il job produce risultati
+        :param client_factory: callable - crea il client di ogni processo (di default un
+                                          InstagramJsonClient)
+        :param sink_factory: callable - riceve un nome e crea il sink in cui un thread scrive
+                                        i risultati (es. NDJSONSink); senza, i risultati
+                                        vengono solo contati
+        :param as_: str - formato dei risultati passati al sink ('json', 'dict', 'orm', 'records')
+        :param discover: bool - aggiunge alla coda i post trovati negli hashtag e nei profili
+        :param max_attempts: int - tentativi dopo i quali un job viene segnato come fallito
+        :param poll_interval: float - secondi di attesa di un thread senza job, mentre altri
+                                      worker possono ancora aggiungerne
+        """
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self.queue = JobQueue(path, max_attempts)
+        self.options = {
+            'threads': threads,
+            'lease': lease,
+            'client_factory': client_factory,
+            'sink_factory': sink_factory,
+            'as_': as_,
+            'discover': discover,
+            'max_attempts': max_attempts,
+            'poll_interval': poll_interval,
+        }
+
+    def add_users(self, users, priority=0, **params):
+        """
+        :param users: str or tuple - username
+        :param params: parametri di iter_by_user (es. count, since, until, seek)
+        :return: int - numero di job nuovi
+        """
+        return self.queue.put_many('user', (users, ) if isinstance(users, str) else users, priority, **params)
+
+    def add_tags(self, tags, priority=0, **params):
+        """
+        :param tags: str or tuple - hashtag (senza il #)
+        :param params: parametri di iter_by_hashtag (es. count, since, until, seek)
+        :return: int - numero di job nuovi
+        """
+        return self.queue.put_many('tag', (tags, ) if isinstance(tags, str) else tags, priority, **params)
+
+    def add_media_codes(self, codes, priority=0, **params):
+        """
+        :param codes: str or tuple - codici dei post
+        :param params: parametri di iter_by_media_codes (es. all_comments)
+        :return: int - numero di job nuovi
+        """
+        return self.queue.put_many('post', (codes, ) if isinstance(codes, str) else codes, priority, **params)
+
+    def _stats(self, start, last, counts):
+        now = time.time()
+        elapsed = now - last[0]
+        stats = dict(counts)
+        stats['seconds'] = now - start
+        stats['items_per_second'] = (counts['items'] - last[1]['items']) / elapsed if elapsed else 0.0
+        stats['jobs_per_second'] = (counts[DONE] - last[1][DONE]) / elapsed if elapsed else 0.0
+        return stats
+
+    def run(self, report=None, report_interval=10.0):
+        """
+        Avvia i processi e attende che la coda sia vuota.
+
+        :param report: callable - chiamata ogni report_interval secondi con lo stato della
+                                  coda e i risultati e job completati al secondo nell'intervallo
+        :param report_interval: float - secondi tra un report e l'altro
+        :return: dict - stato finale della coda, con i risultati e i job al secondo dell'intera
+                        esecuzione
+        """
+        start = time.time()
+        first = (start, self.queue.counts())
+        last = first
+        processes = [
+            multiprocessing.Process(target=_work, args=(self.path, index, self.options), daemon=True)
+            for index in range(self.processes)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            while any(process.is_alive() for process in processes):
+                deadline = time.time() + report_interval
+                for process in processes:
+                    process.join(max(0.0, deadline - time.time()))
+                counts = self.queue.counts()
+                if report is not None:
+                    report(self._stats(start, last, counts))
+                last = (time.time(), counts)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+        return self._stats(start, first, self.queue.counts())
+
+    def close(self):
+        self.queue.close()
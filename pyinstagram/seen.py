@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Indici degli id dei media già visti, per non restituire (e non
+convertire) più volte lo stesso post: ad esempio un post presente
+sotto più hashtag della stessa ricerca, o già scaricato in una
+ricerca precedente.
+
+Gli id vengono controllati prima della creazione dei model e segnati
+come visti solo dopo essere stati restituiti, così che un post
+scartato perché è stato raggiunto count venga restituito la volta
+successiva.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+
+
+class SeenIndex(object):
+    """
+    Indice in memoria (un set) degli id già visti; vale per la
+    durata del processo. Per un indice persistente usare
+    BloomSeenIndex o SQLiteSeenIndex.
+
+    Esempio:
+
+     >>> seen = SeenIndex()
+     >>> app = InstagramJsonClient(seen=seen)
+     >>> app.get_by_hashtag(("mfw", "milanofashionweek"), top_posts=False)
+     >>> seen.skipped
+    """
+    def __init__(self):
+        self.skipped = 0
+        self._ids = set()
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def contains_many(self, ids):
+        """
+        :param ids: list - id dei media
+        :return: list - True per ogni id già visto
+        """
+        return [media_id in self._ids for media_id in ids]
+
+    def add_many(self, ids):
+        """
+        Segna gli id come visti.
+
+        :param ids: list - id dei media
+        :return: None
+        """
+        self._ids.update(ids)
+
+    def claim(self, ids):
+        """
+        Riserva gli id non ancora visti (né riservati da un altro
+        thread), contando come scartati gli altri.
+
+        :param ids: list - id dei media di una pagina
+        :return: list - True per ogni id da restituire
+        """
+        with self._lock:
+            seen = self.contains_many(ids)
+            result = []
+            for media_id, already_seen in zip(ids, seen):
+                new = not already_seen and media_id not in self._claimed
+                if new:
+                    self._claimed.add(media_id)
+                else:
+                    self.skipped += 1
+                result.append(new)
+            return result
+
+    def commit(self, ids):
+        """
+        Segna come visti gli id riservati e restituiti.
+
+        :param ids: list - id dei media
+        :return: None
+        """
+        with self._lock:
+            if ids:
+                self.add_many(ids)
+            self._claimed.difference_update(ids)
+
+    def release(self, ids):
+        """
+        Libera gli id riservati ma non restituiti.
+
+        :param ids: list - id dei media
+        :return: None
+        """
+        with self._lock:
+            self._claimed.difference_update(ids)
+
+    def close(self):
+        pass
+
+
+class BloomSeenIndex(SeenIndex):
+    """
+    Indice basato su un filtro di Bloom: occupa pochi byte per id
+    (circa 1.2 byte con error_rate=0.01) ma può scambiare per già
+    visto, con probabilità error_rate, un post nuovo. Se viene
+    indicato un file, il filtro viene caricato all'avvio e salvato
+    con save() o close().
+    """
+    def __init__(self, capacity=10000000, error_rate=0.001, path=None):
+        """
+        :param capacity: int - numero di id previsti
+        :param error_rate: float - probabilità di falso positivo con capacity id
+        :param path: str - file in cui salvare il filtro
+        """
+        super(BloomSeenIndex, self).__init__()
+        self.path = path
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.hashes = int.from_bytes(f.read(1), 'big')
+                self.size = int.from_bytes(f.read(8), 'big')
+                self._bits = bytearray(f.read())
+        else:
+            self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+            self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, media_id):
+        digest = hashlib.blake2b(str(media_id).encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+        # double hashing: k posizioni da due soli hash
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def contains_many(self, ids):
+        bits = self._bits
+        return [
+            all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(media_id))
+            for media_id in ids
+        ]
+
+    def add_many(self, ids):
+        bits = self._bits
+        for media_id in ids:
+            for position in self._positions(media_id):
+                bits[position >> 3] |= 1 << (position & 7)
+
+    def save(self):
+        """Salva il filtro su file"""
+        if self.path:
+            with self._lock:
+                with open(self.path + '.tmp', 'wb') as f:
+                    f.write(self.hashes.to_bytes(1, 'big'))
+                    f.write(self.size.to_bytes(8, 'big'))
+                    f.write(self._bits)
+                os.replace(self.path + '.tmp', self.path)
+
+    def close(self):
+        self.save()
+
+
+class SQLiteSeenIndex(SeenIndex):
+    """
+    Indice esatto e persistente su SQLite.
+    """
+    # id per ogni query (SQLite limita il numero di parametri)
+    CHUNK = 500
+
+    def __init__(self, path=":memory:"):
+        """
+        :param path: str - file SQLite in cui salvare gli id
+        """
+        super(SQLiteSeenIndex, self).__init__()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (media_id TEXT PRIMARY KEY)")
+
+    def contains_many(self, ids):
+        ids = [str(media_id) for media_id in ids]
+        found = set()
+        for start in range(0, len(ids), self.CHUNK):
+            chunk = ids[start:start + self.CHUNK]
+            found.update(row[0] for row in self._db.execute(
+                "SELECT media_id FROM seen WHERE media_id IN ({})".format(", ".join("?" * len(chunk))), chunk
+            ))
+        return [media_id in found for media_id in ids]
+
+    def add_many(self, ids):
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR IGNORE INTO seen (media_id) VALUES (?)",
+                             [(str(media_id),) for media_id in ids])
+        self._db.execute("COMMIT")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Destinazioni (sink) in cui scrivere i dati scaricati man mano
+che arrivano, senza doverli prima accumulare in una lista.
+"""
+import gzip
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import create_engine
+
+from . import jsonlib
+from .exceptions import PyInstagramException
+from .model import Base
+
+
+def _table(item):
+    """
+    :param item: oggetto Media o Comment, o un record leggero (es. MediaRecord)
+    :return: Table - tabella del model dell'oggetto (None se non è un model né un record)
+    """
+    return getattr(getattr(item, 'model', type(item)), '__table__', None)
+
+
+class DatabaseSink(object):
+    """
+    Scrive oggetti Media e Comment su database a blocchi, con una
+    sola INSERT multipla (executemany) per blocco invece di un flush
+    dell'ORM per ogni oggetto. I duplicati (stessa chiave primaria)
+    vengono ignorati o sovrascritti con un upsert del dialetto in uso
+    (SQLite, PostgreSQL, MySQL); con altri database si può usare solo
+    on_conflict=None, che esegue INSERT semplici.
+
+    Esempio:
+
+     >>> with DatabaseSink("sqlite:///instagram.db", create_tables=True) as sink:
+     >>>     sink.write_many(app.iter_by_hashtag("mfw", top_posts=False))
+    """
+    # database per cui si possono ignorare o sovrascrivere i duplicati
+    UPSERT_DIALECTS = ('sqlite', 'postgresql', 'mysql')
+
+    def __init__(self, engine, batch_size=1000, commit_every=10, on_conflict='ignore', create_tables=False):
+        """
+        :param engine: Engine or str - engine SqlAlchemy o url del database
+        :param batch_size: int - numero di righe per ogni INSERT multipla
+        :param commit_every: int - numero di blocchi scritti per ogni transazione
+        :param on_conflict: str - 'ignore' per tenere la riga già presente,
+                                  'update' per sovrascriverla, None per non gestire
+                                  i duplicati (INSERT semplice, con qualunque database)
+        :param create_tables: bool - crea le tabelle dei model se non esistono
+        """
+        if on_conflict not in ('ignore', 'update', None):
+            raise ValueError("on_conflict deve essere 'ignore', 'update' o None")
+        self.engine = create_engine(engine) if isinstance(engine, str) else engine
+        dialect = self.engine.dialect.name
+        if on_conflict is not None and dialect not in self.UPSERT_DIALECTS:
+            raise ValueError("on_conflict='{}' non è supportato per il database {}: usa on_conflict=None".format(
+                on_conflict, dialect))
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.on_conflict = on_conflict
+        self.written = 0
+        if create_tables:
+            Base.metadata.create_all(self.engine)
+        self._buffers = OrderedDict()
+        self._statements = {}
+        self._pending = 0
+        self._connection = None
+        self._transaction = None
+
+    def write(self, item):
+        """
+        Accoda un oggetto Media o Comment (o un record leggero, come
+        MediaRecord), scrivendo il blocco quando raggiunge batch_size righe.
+
+        :param item: Media or Comment - oggetto da salvare
+        :return: None
+        """
+        table = _table(item)
+        if table is None:
+            raise PyInstagramException(
+                "DatabaseSink accetta solo oggetti Media, Comment o record (as_='orm' o as_='records'), "
+                "non {}".format(type(item).__name__)
+            )
+        row = {column.name: getattr(item, column.key) for column in table.columns}
+        if isinstance(row.get('json'), (dict, list)):
+            # il json arriva già codificato se il client usa raw_json=True
+            row['json'] = jsonlib.dumps(row['json'])
+        buffer = self._buffers.setdefault(table, OrderedDict())
+        # a parità di chiave primaria tengo l'ultima versione ricevuta
+        buffer[tuple(row[column.name] for column in table.primary_key)] = row
+        if len(buffer) >= self.batch_size:
+            self._write_batch(table)
+
+    def write_many(self, items):
+        """
+        :param items: iterable - oggetti Media o Comment
+        :return: int - numero di oggetti ricevuti
+        """
+        count = 0
+        for count, item in enumerate(items, 1):
+            self.write(item)
+        return count
+
+    def _statement(self, table):
+        """
+        :param table: Table - tabella in cui scrivere
+        :return: Insert - INSERT che gestisce i duplicati secondo on_conflict
+        """
+        if table in self._statements:
+            return self._statements[table]
+        dialect = self.engine.dialect.name
+        keys = [column.name for column in table.primary_key]
+        if self.on_conflict is None:
+            statement = table.insert()
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table)
+            if self.on_conflict == 'ignore':
+                statement = statement.on_conflict_do_nothing(index_elements=keys)
+            else:
+                statement = statement.on_conflict_do_update(index_elements=keys, set_={
+                    column.name: statement.excluded[column.name]
+                    for column in table.columns if column.name not in keys
+                })
+        elif dialect == 'sqlite':
+            statement = table.insert().prefix_with('OR IGNORE' if self.on_conflict == 'ignore' else 'OR REPLACE')
+        else:
+            # mysql: gli altri database vengono rifiutati già in __init__
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(table)
+            if self.on_conflict == 'ignore':
+                statement = statement.prefix_with('IGNORE')
+            else:
+                statement = statement.on_duplicate_key_update({
+                    column.name: statement.inserted[column.name]
+                    for column in table.columns if column.name not in keys
+                })
+        self._statements[table] = statement
+        return statement
+
+    def _write_batch(self, table):
+        rows = list(self._buffers.pop(table).values())
+        if not rows:
+            return
+        if self._connection is None:
+            self._connection = self.engine.connect()
+        if self._transaction is None:
+            self._transaction = self._connection.begin()
+        self._connection.execute(self._statement(table), rows)
+        self.written += len(rows)
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        if self._transaction is not None:
+            self._transaction.commit()
+            self._transaction = None
+        self._pending = 0
+
+    def flush(self):
+        """Scrive e conferma tutte le righe in attesa"""
+        for table in list(self._buffers):
+            self._write_batch(table)
+        self._commit()
+
+    def close(self):
+        """Scrive le righe in attesa e chiude la connessione"""
+        self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._transaction is not None:
+            self._transaction.rollback()
+            self._transaction = None
+            self._buffers.clear()
+        self.close()
+
+
+_CLOSE = object()
+
+
+class NDJSONSink(object):
+    """
+    Scrive i dati in file NDJSON (un json per riga), compressi con
+    gzip o zstd, creando un nuovo file quando quello corrente supera
+    una certa dimensione o durata. La serializzazione avviene nel
+    thread che chiama write(), la compressione e la scrittura su
+    disco in un thread dedicato.
+
+    Accetta dizionari (es. as_='json' o as_='dict'), oggetti Media e
+    Comment e i record leggeri (MediaRecord, CommentRecord).
+
+    Esempio:
+
+     >>> with NDJSONSink("export", prefix="mfw", rotate_bytes=512 * 1024 * 1024) as sink:
+     >>>     app.get_by_hashtag("mfw", top_posts=False, as_='records', sink=sink)
+    """
+    EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, directory, prefix='media', compression='gzip', level=None,
+                 rotate_bytes=None, rotate_seconds=None, flush_interval=5, queue_size=10000):
+        """
+        :param directory: str - cartella in cui creare i file
+        :param prefix: str - prefisso del nome dei file
+        :param compression: str - 'gzip', 'zstd' (richiede zstandard) o None
+        :param level: int - livello di compressione (None = 3, veloce sia con gzip che con zstd)
+        :param rotate_bytes: int - dimensione (non compressa) oltre la quale cambiare file
+        :param rotate_seconds: float - durata oltre la quale cambiare file
+        :param flush_interval: float - ogni quanti secondi forzare la scrittura su disco
+        :param queue_size: int - righe massime in attesa di essere scritte
+        """
+        if compression not in self.EXTENSIONS:
+            raise ValueError("compression deve essere 'gzip', 'zstd' o None")
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise PyInstagramException("Per la compressione zstd installa zstandard (pip install pyinstagram[zstd])")
+            self._zstd = zstandard
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.level = level
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.files = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name="NDJSONSink", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _serialize(item):
+        """
+        :param item: dict, Media, Comment o record
+        :return: bytes - riga NDJSON
+        """
+        if isinstance(item, dict):
+            return (jsonlib.dumps(item) + '\n').encode('utf-8')
+        table = _table(item)
+        if table is None:
+            raise PyInstagramException(
+                "NDJSONSink accetta solo dizionari (as_='json' o as_='dict'), oggetti Media, Comment "
+                "o record (as_='orm' o as_='records'), non {}".format(type(item).__name__)
+            )
+        row = {column.key: getattr(item, column.key) for column in table.columns}
+        raw = row.pop('json', None)
+        line = jsonlib.dumps(row)
+        if isinstance(raw, str):
+            # json già codificato (raw_json=True): lo inserisco così com'è
+            line = line[:-1] + ',"json":' + raw + '}'
+        elif raw is not None:
+            line = line[:-1] + ',"json":' + jsonlib.dumps(raw) + '}'
+        return (line + '\n').encode('utf-8')
+
+    def write(self, item):
+        """
+        :param item: dict, Media o MediaRecord - dato da scrivere
+        :return: None
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(self._serialize(item))
+        self.written += 1
+
+    def write_many(self, items):
+        """
+        :param items: iterable - dati da scrivere
+        :return: int - numero di dati scritti
+        """
+        count = 0
+        for count, item in enumerate(items, 1):
+            self.write(item)
+        return count
+
+    def _open(self):
+        name = "{prefix}-{time}-{index:05d}.ndjson{ext}".format(
+            prefix=self.prefix,
+            time=time.strftime("%Y%m%dT%H%M%S"),
+            index=len(self.files),
+            ext=self.EXTENSIONS[self.compression]
+        )
+        path = os.path.join(self.directory, name)
+        if self.compression == 'gzip':
+            handle = gzip.open(path, 'wb', compresslevel=3 if self.level is None else self.level)
+        elif self.compression == 'zstd':
+            compressor = self._zstd.ZstdCompressor(level=3 if self.level is None else self.level)
+            handle = compressor.stream_writer(open(path, 'wb'), closefd=True)
+        else:
+            handle = open(path, 'wb')
+        self.files.append(path)
+        self._file = handle
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate_due(self):
+        if self.rotate_bytes and self._file_bytes >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.monotonic() - self._file_opened >= self.rotate_seconds
+
+    def _run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    line = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    line = None
+                if line is _CLOSE:
+                    break
+                if line is not None:
+                    if self._file is None or self._rotate_due():
+                        self._close_file()
+                        self._open()
+                    self._file.write(line)
+                    self._file_bytes += len(line)
+                if self._file is not None and time.monotonic() - last_flush >= self.flush_interval:
+                    self._file.flush()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            self._error = e
+            # svuoto la coda per non bloccare chi sta scrivendo
+            while self._queue.get() is not _CLOSE:
+                pass
+        finally:
+            self._close_file()
+
+    def close(self):
+        """Scrive le righe in attesa e chiude il file corrente"""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Strato di trasporto HTTP condiviso dai client e da OAuth.
+
+Tutte le richieste passano da un'unica requests.Session, in modo
+da riutilizzare le connessioni TCP/TLS (keep-alive) invece di
+aprirne una nuova per ogni chiamata. Con SessionPool le richieste
+vengono invece distribuite su più sessioni (cookie e proxy diversi),
+scegliendo di volta in volta quella che risponde meglio.
+"""
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import DESAdapter
+
+
+class Transport(object):
+    """
+    Wrapper attorno a una requests.Session con pool di connessioni
+    configurabile. Può essere passato a più oggetti (OAuth,
+    InstagramApiClient, InstagramJsonClient) per condividere le
+    stesse connessioni.
+
+    Esempio:
+
+     >>> transport = Transport(pool_maxsize=20, timeout=(5, 30))
+     >>> auth = OAuth(access_token="...", transport=transport)
+     >>> app = InstagramApiClient(auth)
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, timeout=30, max_retries=0, ssl_context=None, proxies=None):
+        """
+        :param pool_connections: int - numero di host diversi di cui tenere aperte le connessioni
+        :param pool_maxsize: int - numero massimo di connessioni aperte verso lo stesso host
+        :param pool_block: bool - se attivato, non apre più di pool_maxsize connessioni per host
+                                  ma attende che se ne liberi una
+        :param keep_alive: bool - se disattivato, chiude la connessione dopo ogni richiesta
+        :param timeout: float or tuple - timeout di default (connessione, lettura) in secondi
+        :param max_retries: int - tentativi a livello di connessione (vedi requests.adapters.HTTPAdapter)
+        :param ssl_context: SSLContext - contesto SSL da usare (di default quello condiviso di DESAdapter)
+        :param proxies: dict - proxy da usare, nel formato di requests
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+        if proxies:
+            self.session.proxies.update(proxies)
+        pool = dict(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries
+        )
+        self.session.mount('https://', DESAdapter(ssl_context=ssl_context, **pool))
+        self.session.mount('http://', HTTPAdapter(**pool))
+
+    def request(self, method, url, **kwargs):
+        """
+        Effettua una richiesta HTTP usando il pool di connessioni.
+
+        :param method: str - metodo http
+        :param url: str - url da chiamare
+        :param kwargs: parametri aggiuntivi per requests
+        :return: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def close(self):
+        """Chiude tutte le connessioni aperte"""
+        self.session.close()
+
+
+class SessionPool(object):
+    """
+    Insieme di Transport, ognuno con la propria sessione (cookie,
+    DESAdapter, proxy), da usare al posto di un singolo Transport.
+    Ogni richiesta va alla sessione più "sana", cioè con la latenza
+    media e la percentuale di errori più basse nelle ultime richieste;
+    una sessione che riceve un 429 viene messa a riposo e la richiesta
+    viene ripetuta subito su un'altra.
+
+    Esempio:
+
+     >>> pool = SessionPool(proxies=["http://proxy1:3128", "http://proxy2:3128", None])
+     >>> app = InstagramJsonClient(transport=pool)
+     >>> pool.health()
+    """
+    # risposte che indicano una sessione limitata o in difficoltà
+    THROTTLED = (429, )
+    ERRORS = (500, 502, 503, 504)
+
+    def __init__(self, proxies=None, size=None, rest=60, window=20, error_penalty=5.0, **kwargs):
+        """
+        :param proxies: list - un proxy per sessione (url, dizionario nel formato di
+                               requests o None per la connessione diretta)
+        :param size: int - numero di sessioni senza proxy (se proxies non è indicato)
+        :param rest: float - secondi di riposo di una sessione dopo un 429
+        :param window: int - numero di richieste recenti usate per il punteggio
+        :param error_penalty: float - secondi di latenza equivalenti a una richiesta fallita
+        :param kwargs: parametri di Transport (pool_maxsize, timeout, ...)
+        """
+        if proxies is None:
+            proxies = [None] * (size or 1)
+        self.rest = rest
+        self.error_penalty = error_penalty
+        self.transports = []
+        for proxy in proxies:
+            if isinstance(proxy, str):
+                proxy = {'http': proxy, 'https': proxy}
+            self.transports.append(Transport(proxies=proxy, **kwargs))
+        self._samples = [deque(maxlen=window) for _ in self.transports]
+        self._resting = [0.0] * len(self.transports)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """La sessione più sana (per compatibilità con Transport)"""
+        return self.transports[self._choose()].session
+
+    def _score(self, index):
+        samples = self._samples[index]
+        if not samples:
+            # le sessioni mai usate vanno provate per prime
+            return 0.0
+        return sum(latency + self.error_penalty * error for latency, error in samples) / len(samples)
+
+    def _choose(self):
+        """
+        :return: int - indice della sessione da usare (attende se sono tutte a riposo)
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                ready = [index for index, until in enumerate(self._resting) if until <= now]
+                if ready:
+                    return min(ready, key=self._score)
+                wait = min(self._resting) - now
+            # tutte le sessioni sono limitate: aspetto la prima che torna disponibile
+            time.sleep(wait)
+
+    def _record(self, index, latency, error, throttled=False):
+        with self._lock:
+            self._samples[index].append((latency, error))
+            if throttled:
+                self._resting[index] = time.monotonic() + self.rest
+
+    def request(self, method, url, **kwargs):
+        """
+        Effettua una richiesta HTTP sulla sessione più sana, ripetendola
+        su un'altra sessione se quella scelta viene limitata (429).
+
+        :param method: str - metodo http
+        :param url: str - url da chiamare
+        :param kwargs: parametri aggiuntivi per requests
+        :return: requests.Response
+        """
+        for attempt in range(len(self.transports)):
+            index = self._choose()
+            start = time.monotonic()
+            try:
+                res = self.transports[index].request(method, url, **kwargs)
+            except requests.RequestException:
+                self._record(index, time.monotonic() - start, True)
+                raise
+            throttled = res.status_code in self.THROTTLED
+            self._record(index, time.monotonic() - start, throttled or res.status_code in self.ERRORS, throttled)
+            if not throttled:
+                break
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def health(self):
+        """
+        :return: list - per ogni sessione: proxy, punteggio (secondi), percentuale di
+                        errori recenti e secondi di riposo residui
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'proxies': transport.session.proxies or None,
+                'score': self._score(index),
+                'error_rate': (sum(error for _, error in self._samples[index]) / len(self._samples[index])
+                               if self._samples[index] else 0.0),
+                'resting': max(0.0, self._resting[index] - now),
+            } for index, transport in enumerate(self.transports)]
+
+    def close(self):
+        """Chiude le connessioni di tutte le sessioni"""
+        for transport in self.transports:
+            transport.close()
@@ -3,9 +3,16 @@
 Modulo contenente classi e metodi di pubblica utilità,
 non per forza strettamente collegati a questa libreria.
 """
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from requests.adapters import HTTPAdapter
 from urllib3.util.ssl_ import create_urllib3_context
 
+from .constants import INSTAGRAM_EPOCH
+
 CIPHERS = (
     'ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:ECDH+AES128:DH+AES:ECDH+HIGH:'
     'DH+HIGH:ECDH+3DES:DH+3DES:RSA+AESGCM:RSA+AES:RSA+HIGH:RSA+3DES:!aNULL:'
@@ -17,13 +24,197 @@ class DESAdapter(HTTPAdapter):
     """
     Un TransportAdapter che ha lo scopo di abilitare il
     supporto 3DES nella libreria requests.
+
+    Il contesto SSL viene creato una sola volta e condiviso da
+    tutti gli adapter (a meno che non ne venga passato uno),
+    invece di essere ricreato per ogni pool di connessioni.
     """
+    _shared_context = None
+    _lock = threading.Lock()
+
+    def __init__(self, *args, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context or self.shared_context()
+        super(DESAdapter, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def shared_context(cls):
+        """
+        :return: SSLContext - contesto SSL con i cifrari 3DES abilitati
+        """
+        with cls._lock:
+            if cls._shared_context is None:
+                cls._shared_context = create_urllib3_context(ciphers=CIPHERS)
+            return cls._shared_context
+
     def init_poolmanager(self, *args, **kwargs):
-        context = create_urllib3_context(ciphers=CIPHERS)
-        kwargs['ssl_context'] = context
+        kwargs['ssl_context'] = self.ssl_context
         return super(DESAdapter, self).init_poolmanager(*args, **kwargs)
 
     def proxy_manager_for(self, *args, **kwargs):
-        context = create_urllib3_context(ciphers=CIPHERS)
-        kwargs['ssl_context'] = context
-        return super(DESAdapter, self).proxy_manager_for(*args, **kwargs)
\ No newline at end of file
+        kwargs['ssl_context'] = self.ssl_context
+        return super(DESAdapter, self).proxy_manager_for(*args, **kwargs)
+
+
+_DONE = object()
+
+
+class Deferred(object):
+    """
+    Azione inserita in un flusso di risultati, da eseguire solo
+    quando il consumatore raggiunge quel punto del flusso (ad esempio
+    il salvataggio del cursore dopo l'ultimo post di una pagina).
+    take e iter_parallel la eseguono invece di restituirla, quindi
+    un'azione che segue elementi mai letti non viene mai eseguita.
+    """
+
+    __slots__ = ('action', 'args')
+
+    def __init__(self, action, *args):
+        """
+        :param action: callable - funzione da chiamare
+        :param args: argomenti della funzione
+        """
+        self.action = action
+        self.args = args
+
+    def __call__(self):
+        self.action(*self.args)
+
+
+def _close(iterable):
+    close = getattr(iterable, 'close', None)
+    if close is not None:
+        close()
+
+
+def take(iterable, count=None):
+    """
+    Come itertools.islice(iterable, count), ma appena raggiunto il
+    limite chiude l'iterabile sorgente, in modo che eventuali
+    generatori a monte (e la relativa paginazione) si fermino subito.
+    Le azioni Deferred del flusso vengono eseguite e non contano.
+
+    :param iterable: iterable - sorgente dei dati
+    :param count: int - numero massimo di elementi (None o 0 = tutti)
+    :return: generator
+    """
+    iterator = iter(iterable)
+    n = 0
+    try:
+        for item in iterator:
+            if isinstance(item, Deferred):
+                item()
+                continue
+            n += 1
+            yield item
+            if count and n >= count:
+                return
+    finally:
+        _close(iterator)
+
+
+def iter_parallel(iterables, workers=4, buffer_size=100):
+    """
+    Consuma più iterabili in parallelo su un pool di thread e ne
+    unisce i risultati alternandoli (round-robin), così che una
+    sorgente più veloce non monopolizzi l'output.
+
+    Al massimo buffer_size elementi restano in memoria in attesa
+    di essere consumati; chiudendo il generatore (o esaurendolo)
+    tutti i thread si fermano alla prima occasione utile. Un errore
+    in una delle sorgenti viene risollevato nel chiamante. Le azioni
+    Deferred vengono eseguite nel thread del chiamante, quando tutti
+    gli elementi che le precedono nella loro sorgente sono stati
+    restituiti.
+
+    :param iterables: iterable - sorgenti da consumare
+    :param workers: int - numero di thread
+    :param buffer_size: int - elementi massimi in attesa
+    :return: generator
+    """
+    iterables = list(iterables)
+    out = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(index, iterable):
+        if stop.is_set():
+            return
+        try:
+            for item in iterable:
+                if not put((index, item, None)):
+                    return
+        except Exception as e:
+            put((index, _DONE, e))
+        else:
+            put((index, _DONE, None))
+        finally:
+            _close(iterable)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for index, iterable in enumerate(iterables):
+        executor.submit(produce, index, iterable)
+
+    buffers = [deque() for _ in iterables]
+    pending = len(iterables)
+    buffered = 0
+    try:
+        while pending or buffered:
+            # raccolgo quello che è pronto, aspettando solo se non ho nulla da restituire
+            block = not buffered
+            while pending and (block or buffered < buffer_size):
+                try:
+                    index, item, error = out.get(block=block)
+                except queue.Empty:
+                    break
+                block = False
+                if item is _DONE:
+                    pending -= 1
+                    if error is not None:
+                        raise error
+                else:
+                    buffers[index].append(item)
+                    buffered += 1
+            # un elemento per sorgente, a turno
+            for buffer in buffers:
+                while buffer:
+                    buffered -= 1
+                    item = buffer.popleft()
+                    if not isinstance(item, Deferred):
+                        yield item
+                        break
+                    item()
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def media_id_to_timestamp(media_id):
+    """
+    Ricava la data di creazione di un post dal suo id: i bit
+    dal 23° in su sono i millisecondi trascorsi da INSTAGRAM_EPOCH.
+
+    :param media_id: str or int - id del media (es. "1606977067425770236" o "1606977067425770236_528817151")
+    :return: float - Unix Timestamp
+    """
+    media_id = int(str(media_id).split('_')[0])
+    return ((media_id >> 23) + INSTAGRAM_EPOCH) / 1000.0
+
+
+def timestamp_to_media_id(timestamp):
+    """
+    Costruisce il più piccolo id di un post creato in un certo
+    istante: usato come max_id restituisce i post precedenti.
+
+    :param timestamp: float - Unix Timestamp
+    :return: int - id del media
+    """
+    return max(0, int(timestamp * 1000) - INSTAGRAM_EPOCH) << 23
@@ -12,5 +12,12 @@ setup(
     install_requires=[
             "requests==2.18.4",
             "sqlalchemy==1.1.14",
-    ]
+    ],
+    extras_require={
+        "numpy": ["numpy"],
+        "arrow": ["pyarrow"],
+        "pandas": ["numpy", "pandas"],
+        "fastjson": ["orjson"],
+        "zstd": ["zstandard"],
+    }
 )